@@ -0,0 +1,166 @@
+"""
+Arquiva no S3 as despesas mais antigas que o horizonte configurado e as remove do DynamoDB.
+
+As despesas com data anterior a hoje - EXPENSE_ARCHIVE_HORIZON_DAYS são agrupadas por
+usuário e ano em objetos JSON comprimidos (<prefixo><userId>/<ano>.json.gz), no mesmo
+formato lido pelo GET /expenses?startDate=...&endDate=... de get-put-expense.py:
+
+    EXPENSE_ARCHIVE_BUCKET=meu-bucket DYNAMODB_TABLE=Receipts python archive-expenses.py --dry-run
+    EXPENSE_ARCHIVE_BUCKET=meu-bucket DYNAMODB_TABLE=Receipts python archive-expenses.py --horizon-days 730
+
+Um objeto já existente é mesclado com as novas despesas e regravado com escrita
+condicional (If-Match), então execuções concorrentes não perdem despesas. Os itens só
+são apagados das tabelas do KEY_SCHEMA configurado depois que o objeto foi gravado, com
+exclusão condicional: uma despesa editada ou reprocessada depois do scan fica no DynamoDB
+(contada em 'conflicts') e a versão nova substitui a arquivada na próxima execução; uma
+despesa excluída pelo usuário nesse intervalo é retirada de novo do objeto ('removed').
+Pode ser executado novamente com segurança. O índice de preços por item não é alterado.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+import expensearchive
+import receiptprocessor
+
+def expired_expenses(segment, total_segments, cutoff):
+    """Lista as despesas de um segmento do scan paralelo com data anterior ao corte"""
+    # Os itens de progresso de ZIP (date 'ARCHIVE') não têm userId e ficam de fora
+    expenses = receiptprocessor.scan_segment(
+        receiptprocessor.source_table(), segment, total_segments,
+        FilterExpression=Attr('date').lt(cutoff) & Attr('userId').exists()
+    )
+    return [{k: v for k, v in expense.items() if k != 'sort_key'} for expense in expenses]
+
+def row_exists(table, key):
+    """Verifica com leitura consistente se a linha ainda está na tabela"""
+    return 'Item' in table.get_item(Key=key, ConsistentRead=True, ProjectionExpression='receipt_id')
+
+def delete_archived(expenses):
+    """
+    Apaga das tabelas as despesas já gravadas no S3, cada uma com exclusão condicional.
+    Retorna as contagens (apagadas e alteradas desde o scan, os conflitos) e os
+    receipt_ids das despesas que o usuário excluiu depois do scan.
+    """
+    counts = {'deleted': 0, 'conflicts': 0}
+    removed = []
+    tables = receiptprocessor.receipt_tables()
+    for expense in expenses:
+        status = 'deleted'
+        for position, (table, user_partitioned) in enumerate(tables):
+            key = receiptprocessor.table_key(expense, user_partitioned)
+            try:
+                table.delete_item(Key=key, ConditionExpression=receiptprocessor.unchanged_condition(expense))
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                if row_exists(table, key):
+                    # Editada depois do scan: fica no DynamoDB e é mesclada de novo na próxima execução
+                    status = 'conflicts'
+                    break
+                # Sem linha na tabela de origem, o usuário excluiu a despesa depois do scan;
+                # nas demais (KEY_SCHEMA 'dual' antes da migração) apenas não há o que apagar
+                if position == 0:
+                    status = 'removed'
+        if status == 'removed':
+            removed.append(expense['receipt_id'])
+        else:
+            counts[status] += 1
+    return counts, removed
+
+def drop_from_archive(s3, bucket, key, receipt_ids, attempts=3):
+    """Retira do objeto as despesas excluídas pelo usuário durante o arquivamento"""
+    for attempt in range(attempts):
+        etag, archived = expensearchive.read_archive(s3, bucket, key)
+        try:
+            expensearchive.write_archive(
+                s3, bucket, key, [expense for expense in archived if expense['receipt_id'] not in receipt_ids], etag
+            )
+            return
+        except ClientError as e:
+            # Outro processo regravou o objeto: lê de novo e tenta outra vez
+            if e.response['Error']['Code'] != 'PreconditionFailed' or attempt == attempts - 1:
+                raise
+
+def archive_group(s3, bucket, prefix, user_id, year, expenses, dry_run):
+    """
+    Mescla as despesas no objeto do usuário/ano, o grava e só então as apaga do DynamoDB.
+    Retorna o total de despesas no objeto e as contagens de delete_archived.
+    """
+    key = expensearchive.expense_archive_key(user_id, year, prefix)
+    etag, archived = expensearchive.read_archive(s3, bucket, key)
+
+    merged = {expense['receipt_id']: expense for expense in archived}
+    merged.update((expense['receipt_id'], expense) for expense in expenses)
+    ordered = sorted(merged.values(), key=lambda expense: expense['date'], reverse=True)
+    if dry_run:
+        return len(ordered), {'deleted': len(expenses), 'conflicts': 0, 'removed': 0}
+
+    expensearchive.write_archive(s3, bucket, key, ordered, etag)
+    counts, removed = delete_archived(expenses)
+    if removed:
+        # Sem isso a cópia arquivada traria de volta uma despesa excluída (e somente leitura)
+        drop_from_archive(s3, bucket, key, set(removed))
+    return len(ordered) - len(removed), dict(counts, removed=len(removed))
+
+def main():
+    parser = argparse.ArgumentParser(description='Arquiva no S3 as despesas antigas e as remove do DynamoDB.')
+    parser.add_argument('--bucket', default=expensearchive.EXPENSE_ARCHIVE_BUCKET,
+                        help='Bucket dos arquivos (EXPENSE_ARCHIVE_BUCKET)')
+    parser.add_argument('--prefix', default=expensearchive.EXPENSE_ARCHIVE_PREFIX,
+                        help='Prefixo das chaves (EXPENSE_ARCHIVE_PREFIX)')
+    parser.add_argument('--horizon-days', type=int, default=expensearchive.EXPENSE_ARCHIVE_HORIZON_DAYS,
+                        help='Arquiva despesas com mais de N dias (EXPENSE_ARCHIVE_HORIZON_DAYS)')
+    parser.add_argument('--segments', type=int, default=4, help='Segmentos do scan paralelo')
+    parser.add_argument('--workers', type=int, default=8, help='Objetos gravados em paralelo no S3')
+    parser.add_argument('--dry-run', action='store_true', help='Apenas mostra o que seria arquivado')
+    args = parser.parse_args()
+
+    if not args.bucket:
+        raise SystemExit('Defina EXPENSE_ARCHIVE_BUCKET (ou --bucket) com o bucket dos arquivos.')
+    cutoff = expensearchive.archive_cutoff_date(args.horizon_days)
+
+    groups = {}
+    with ThreadPoolExecutor(max_workers=args.segments) as executor:
+        futures = [
+            executor.submit(expired_expenses, segment, args.segments, cutoff)
+            for segment in range(args.segments)
+        ]
+        for future in futures:
+            for expense in future.result():
+                groups.setdefault((expense['userId'], expense['date'][:4]), []).append(expense)
+    print(f"{sum(len(expenses) for expenses in groups.values())} despesas anteriores a {cutoff} "
+          f"em {len(groups)} arquivos (usuário/ano)")
+
+    counters = {'archived': 0, 'conflicts': 0, 'removed': 0, 'objects': 0, 'failed': 0}
+    s3 = boto3.client('s3')
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(archive_group, s3, args.bucket, args.prefix, user_id, year, expenses, args.dry_run):
+                (user_id, year, expenses)
+            for (user_id, year), expenses in groups.items()
+        }
+        for future in as_completed(futures):
+            user_id, year, expenses = futures[future]
+            try:
+                total, counts = future.result()
+            except ClientError as e:
+                # As despesas continuam no DynamoDB e serão arquivadas na próxima execução
+                counters['failed'] += 1
+                print(f"ERRO ao arquivar {user_id}/{year}: {e.response['Error']['Message']}")
+                continue
+            if args.dry_run:
+                print(f"{expensearchive.expense_archive_key(user_id, year, args.prefix)}: "
+                      f"+{len(expenses)} despesas ({total} no total)")
+            counters['archived'] += counts['deleted']
+            counters['conflicts'] += counts['conflicts']
+            counters['removed'] += counts['removed']
+            counters['objects'] += 1
+
+    print(f"Arquivamento concluído{' (dry-run)' if args.dry_run else ''}: {counters}")
+
+if __name__ == '__main__':
+    main()
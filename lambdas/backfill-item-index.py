@@ -0,0 +1,165 @@
+"""
+Reconstrói o índice de preços por item (ITEM_INDEX_TABLE) a partir das despesas existentes.
+
+Percorre a tabela de despesas do KEY_SCHEMA configurado com um scan paralelo e, se
+EXPENSE_ARCHIVE_BUCKET estiver definido, os arquivos de despesas antigas no S3
+(archive-expenses.py), para que as compras arquivadas continuem no índice. Grava uma
+linha por item de linha (pk 'userId#item', sk 'date#receipt_id'), apaga as linhas que
+não correspondem a nenhuma despesa (excluída ou com a data alterada enquanto o índice
+não era mantido) e, ao final, regrava os resumos de cada item do usuário recalculados
+do zero:
+
+    ITEM_INDEX_TABLE=ItemPrices DYNAMODB_TABLE=Receipts python backfill-item-index.py --dry-run
+    ITEM_INDEX_TABLE=ItemPrices DYNAMODB_TABLE=Receipts python backfill-item-index.py --segments 8
+
+Os resumos são regravados com os totais lidos no scan, e não com ADD: as alterações que
+as Lambdas fizerem no índice durante a execução são perdidas. Pause as gravações de
+despesas (uploads, POST/PUT/DELETE e archive-expenses.py) enquanto ele roda; com as
+gravações pausadas, pode ser executado novamente com segurança.
+"""
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import boto3
+
+import expensearchive
+import itemindex
+import receiptprocessor
+
+def index_expense(batch, expense, dry_run, summaries, row_keys):
+    """Grava as linhas de uma despesa e as acumula nos resumos e nas chaves esperadas"""
+    for key, entry in itemindex.item_index_entries(expense).items():
+        row = itemindex.item_index_row(expense, key, entry)
+        row_keys.add((row['pk'], row['sk']))
+        if not dry_run:
+            batch.put_item(Item=row)
+        summary = summaries.setdefault((expense['userId'], key), {
+            'item_name': entry['name'],
+            'purchase_count': 0,
+            'total_quantity': Decimal('0'),
+            'total_spent': Decimal('0')
+        })
+        summary['purchase_count'] += 1
+        summary['total_quantity'] += entry['quantity']
+        summary['total_spent'] += entry['price']
+
+def backfill_segment(index_name, segment, total_segments, dry_run, progress):
+    """
+    Indexa as despesas de um segmento. Retorna os ids (userId, receipt_id) indexados,
+    os resumos parciais {(userId, item): resumo} e as chaves (pk, sk) das linhas gravadas.
+    """
+    receipt_ids, summaries, row_keys = set(), {}, set()
+    with receiptprocessor.dynamodb_resource().Table(index_name).batch_writer() as batch:
+        for expense in receiptprocessor.scan_segment(receiptprocessor.source_table(), segment, total_segments):
+            if not expense.get('userId') or expense['receipt_id'].startswith('archive-'):
+                continue
+            receipt_ids.add((expense['userId'], expense['receipt_id']))
+            index_expense(batch, expense, dry_run, summaries, row_keys)
+            progress.add()
+    return receipt_ids, summaries, row_keys
+
+def read_archived_expenses(bucket, prefix, workers):
+    """Lê, em paralelo, todas as despesas dos arquivos sob o prefixo"""
+    s3 = boto3.client('s3')
+    keys = list(expensearchive.list_archives(s3, bucket, prefix))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _, expenses in executor.map(lambda key: expensearchive.read_archive(s3, bucket, key), keys):
+            yield from expenses
+
+def stale_rows(index_name, segment, total_segments, summaries, row_keys):
+    """Chaves das linhas de um segmento do índice que não correspondem a nenhuma despesa"""
+    stale = []
+    for row in receiptprocessor.scan_segment(receiptprocessor.dynamodb_resource().Table(index_name),
+                                             segment, total_segments):
+        if row['sk'].startswith(itemindex.SUMMARY_PREFIX):
+            expected = (row['pk'], row['sk'][len(itemindex.SUMMARY_PREFIX):]) in summaries
+        else:
+            expected = (row['pk'], row['sk']) in row_keys
+        if not expected:
+            stale.append({'pk': row['pk'], 'sk': row['sk']})
+    return stale
+
+class Progress:
+    """Contador de despesas processadas, exibido periodicamente"""
+
+    def __init__(self, every=500):
+        self._lock = threading.Lock()
+        self.every = every
+        self.count = 0
+
+    def add(self):
+        with self._lock:
+            self.count += 1
+            if self.count % self.every == 0:
+                print(f"{self.count} despesas indexadas...")
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconstrói o índice de preços por item.')
+    parser.add_argument('--segments', type=int, default=4, help='Segmentos do scan paralelo')
+    parser.add_argument('--archive-bucket', default=expensearchive.EXPENSE_ARCHIVE_BUCKET,
+                        help='Bucket das despesas arquivadas (EXPENSE_ARCHIVE_BUCKET); vazio as ignora')
+    parser.add_argument('--archive-prefix', default=expensearchive.EXPENSE_ARCHIVE_PREFIX,
+                        help='Prefixo das despesas arquivadas (EXPENSE_ARCHIVE_PREFIX)')
+    parser.add_argument('--dry-run', action='store_true', help='Apenas calcula, sem gravar nem apagar')
+    args = parser.parse_args()
+
+    if not receiptprocessor.ITEM_INDEX_TABLE:
+        raise SystemExit('Defina ITEM_INDEX_TABLE com o nome da tabela do índice.')
+    progress = Progress()
+    receipt_ids, summaries, row_keys = set(), {}, set()
+
+    with ThreadPoolExecutor(max_workers=args.segments) as executor:
+        futures = [
+            executor.submit(backfill_segment, receiptprocessor.ITEM_INDEX_TABLE,
+                            segment, args.segments, args.dry_run, progress)
+            for segment in range(args.segments)
+        ]
+        for future in futures:
+            segment_ids, segment_summaries, segment_keys = future.result()
+            receipt_ids |= segment_ids
+            row_keys |= segment_keys
+            for summary_key, partial in segment_summaries.items():
+                summary = summaries.setdefault(summary_key, dict(partial, purchase_count=0,
+                                                                 total_quantity=Decimal('0'), total_spent=Decimal('0')))
+                summary['purchase_count'] += partial['purchase_count']
+                summary['total_quantity'] += partial['total_quantity']
+                summary['total_spent'] += partial['total_spent']
+
+    index_table = receiptprocessor.dynamodb.Table(receiptprocessor.ITEM_INDEX_TABLE)
+    archived = 0
+    if args.archive_bucket:
+        with index_table.batch_writer() as batch:
+            for expense in read_archived_expenses(args.archive_bucket, args.archive_prefix, args.segments):
+                # Uma despesa ainda no DynamoDB (conflito do arquivamento) tem precedência
+                if (expense['userId'], expense['receipt_id']) in receipt_ids:
+                    continue
+                receipt_ids.add((expense['userId'], expense['receipt_id']))
+                index_expense(batch, expense, args.dry_run, summaries, row_keys)
+                archived += 1
+
+    with ThreadPoolExecutor(max_workers=args.segments) as executor:
+        stale = [
+            key
+            for segment_stale in executor.map(
+                lambda segment: stale_rows(receiptprocessor.ITEM_INDEX_TABLE, segment, args.segments,
+                                           summaries, row_keys),
+                range(args.segments)
+            )
+            for key in segment_stale
+        ]
+
+    if not args.dry_run:
+        with index_table.batch_writer() as batch:
+            for key in stale:
+                batch.delete_item(Key=key)
+            for (user_id, key), summary in summaries.items():
+                batch.put_item(Item=dict(itemindex.item_summary_key(user_id, key), **summary))
+
+    print(f"Backfill concluído{' (dry-run)' if args.dry_run else ''}: "
+          f"{progress.count} despesas, {archived} arquivadas, {len(summaries)} itens distintos, "
+          f"{len(stale)} linhas obsoletas removidas")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Micro-benchmark da serialização das respostas do GET /expenses.
+
+Compara o caminho antigo (json.dumps(..., default=str)) com dumps_response de
+dynamodbjson.py (usado por get-put-expense.py), com a biblioteca padrão e, se
+instalado, com orjson:
+
+    python bench-json-encoding.py --expenses 5000 --repeat 20
+"""
+import argparse
+import json
+import random
+import timeit
+from decimal import Decimal
+
+import dynamodbjson
+
+# Valores numéricos limite que as duas implementações devem serializar da mesma forma
+EDGE_VALUES = {
+    'int64_max': Decimal('9223372036854775807'),
+    'int64_min': Decimal('-9223372036854775808'),
+    'above_int64': Decimal('100000000000000000000'),
+    'below_int64': Decimal('-9223372036854775809'),
+    'fraction': Decimal('0.10'),
+    'exponent': Decimal('1E+3')
+}
+
+def check_edge_values(backends):
+    """Confere que todos os backends serializam EDGE_VALUES sem erro e com o mesmo resultado"""
+    decoded = []
+    for backend in backends:
+        dynamodbjson.orjson = backend
+        decoded.append(json.loads(dynamodbjson.dumps_response(EDGE_VALUES)))
+    if any(result != decoded[0] for result in decoded):
+        raise SystemExit(f"Serializações divergentes para valores limite: {decoded}")
+
+def sample_expenses(count):
+    """Despesas no formato retornado pelo boto3, com Decimals como nos itens lidos do DynamoDB"""
+    random.seed(42)
+    expenses = []
+    for index in range(count):
+        items = [
+            {
+                'name': f"Item {random.randint(1, 200)}",
+                'price': Decimal(random.randint(100, 50000)) / 100,
+                'quantity': Decimal(random.randint(1, 5))
+            }
+            for _ in range(random.randint(1, 15))
+        ]
+        expenses.append({
+            'receipt_id': f"manual-20240101000000-{index:08x}",
+            'userId': 'a1b2c3d4-0000-0000-0000-000000000000',
+            'date': f"2024-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}",
+            'vendor': f"Mercado {random.randint(1, 50)}",
+            'total': sum(item['price'] for item in items),
+            'items': items,
+            'category': 'Alimentação',
+            's3_path': 'MANUAL_ENTRY',
+            'processed_timestamp': '2024-01-01T00:00:00.000000'
+        })
+    return expenses
+
+def main():
+    parser = argparse.ArgumentParser(description='Compara a serialização das respostas da API de despesas.')
+    parser.add_argument('--expenses', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    expenses = sample_expenses(args.expenses)
+    orjson = dynamodbjson.orjson
+
+    candidates = [('json.dumps(default=str)', None), ('dumps_response (json)', None)]
+    if orjson is not None:
+        candidates.append(('dumps_response (orjson)', orjson))
+    else:
+        print('orjson não instalado; apenas a biblioteca padrão será medida.')
+
+    check_edge_values([backend for _, backend in candidates[1:]])
+
+    baseline = None
+    for name, backend in candidates:
+        dynamodbjson.orjson = backend
+        if name.startswith('json.dumps'):
+            encode = lambda: json.dumps(expenses, default=str)
+        else:
+            encode = lambda: dynamodbjson.dumps_response(expenses)
+        seconds = min(timeit.repeat(encode, number=1, repeat=args.repeat))
+        baseline = baseline or seconds
+        print(f"{name:<26} {seconds * 1000:8.2f} ms  {baseline / seconds:5.2f}x  ({len(encode())} bytes)")
+
+if __name__ == '__main__':
+    main()
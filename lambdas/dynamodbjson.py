@@ -0,0 +1,41 @@
+"""
+Serialização JSON de dados lidos do DynamoDB (Decimals e sets), compartilhada pela
+Lambda get-put-expense (corpo das respostas) e pelo arquivamento de despesas no S3.
+
+Usa orjson (dependência declarada em requirements.txt); a biblioteca json padrão é
+apenas um fallback para execuções locais, mais lento (ver bench-json-encoding.py).
+"""
+import json
+import logging
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    logging.getLogger(__name__).warning(
+        "orjson is not installed: responses are serialized with the slower stdlib json encoder"
+    )
+
+# orjson só serializa inteiros de 64 bits com sinal
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+def dynamodb_json_default(value):
+    """Converte os tipos do DynamoDB que o JSON não suporta: Decimal vira número e sets viram listas"""
+    if type(value) is Decimal:
+        # Converter a partir do texto é mais barato que comparar Decimals (to_integral_value)
+        text = str(value)
+        if '.' in text or 'E' in text:
+            return float(text)
+        number = int(text)
+        # Inteiros maiores viram float (o mesmo valor que um cliente JavaScript leria)
+        return number if INT64_MIN <= number <= INT64_MAX else float(number)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return str(value)
+
+def dumps_response(data):
+    """Serializa dados do DynamoDB em JSON compacto (orjson; a biblioteca json padrão é só um fallback)"""
+    if orjson is not None:
+        return orjson.dumps(data, default=dynamodb_json_default).decode('utf-8')
+    return json.dumps(data, default=dynamodb_json_default, separators=(',', ':'))
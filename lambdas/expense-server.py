@@ -0,0 +1,225 @@
+"""
+Servidor HTTP local para o handler de get-put-expense.py, sem API Gateway/Lambda.
+
+Atende as mesmas rotas (/expenses, /expenses/{receipt_id} e /expenses/items/{item_name}) com um servidor
+multi-thread HTTP/1.1 (keep-alive). Todas as threads compartilham um único cliente do DynamoDB
+(thread-safe) e o seu pool de conexões, dimensionado com --max-pool-connections.
+O autorizador Cognito é substituído por um verificador de JWT plugável:
+
+    # Verificação com o JWKS do Cognito (requer PyJWT[crypto])
+    COGNITO_USER_POOL_ID=us-east-1_XXXXX python expense-server.py --port 8080
+
+    # Verificador próprio: função que recebe o token e retorna as claims (ou lança exceção)
+    python expense-server.py --verifier meu_modulo:verificar_token
+
+    # Apenas para testes de carga locais: aceita o token sem validar a assinatura
+    python expense-server.py --verifier unverified
+"""
+import argparse
+import base64
+import importlib
+import importlib.util
+import json
+import logging
+import os
+import re
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import boto3
+from botocore.config import Config
+
+logger = logging.getLogger('expense-server')
+
+EXPENSES_ROUTE = re.compile(r'^/expenses/?$')
+EXPENSE_ITEM_ROUTE = re.compile(r'^/expenses/(?P<receipt_id>[^/]+)/?$')
+ITEM_PRICES_ROUTE = re.compile(r'^/expenses/items/(?P<item_name>[^/]+)/?$')
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
+    'Access-Control-Allow-Headers': 'Authorization, Content-Type'
+}
+
+class ThreadLocalResource:
+    """
+    Encaminha os acessos a um resource do boto3 criado para cada thread. Resources do boto3
+    não são thread-safe (os clientes são), e cada conexão keep-alive é atendida por uma thread;
+    a fábrica deve reaproveitar um cliente compartilhado para que a criação seja barata.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        resource = getattr(self._local, 'resource', None)
+        if resource is None:
+            resource = self._local.resource = self._factory()
+        return getattr(resource, name)
+
+def load_expense_handler(max_pool_connections):
+    """Carrega get-put-expense.py (nome com hífen) com resources por thread sobre um cliente compartilhado"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'get-put-expense.py')
+    spec = importlib.util.spec_from_file_location('get_put_expense', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    shared = boto3.session.Session().resource('dynamodb', config=Config(max_pool_connections=max_pool_connections))
+    # Cada thread ganha só um objeto resource novo (cerca de 0,1 ms), sem nova sessão, pool ou handshake TLS
+    module.dynamodb = ThreadLocalResource(lambda: type(shared)(client=shared.meta.client))
+    # As métricas acumulam uma invocação por vez, o que não vale para requisições simultâneas
+    module.invocationmetrics.METRICS_ENABLED = False
+    return module
+
+def unverified_claims(token):
+    """Decodifica as claims do JWT sem verificar a assinatura (somente para testes locais)"""
+    payload = token.split('.')[1]
+    return json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+
+def cognito_verifier(user_pool_id, client_id=None):
+    """Cria um verificador de ID tokens do Cognito usando o JWKS do User Pool"""
+    try:
+        import jwt
+    except ImportError:
+        raise SystemExit("O verificador do Cognito requer PyJWT: pip install 'PyJWT[crypto]'")
+
+    region = user_pool_id.split('_')[0]
+    issuer = f"https://cognito-idp.{region}.amazonaws.com/{user_pool_id}"
+    # PyJWKClient mantém as chaves em cache, então o JWKS é buscado uma única vez
+    jwks_client = jwt.PyJWKClient(f"{issuer}/.well-known/jwks.json")
+
+    def verify(token):
+        signing_key = jwks_client.get_signing_key_from_jwt(token)
+        return jwt.decode(
+            token,
+            signing_key.key,
+            algorithms=['RS256'],
+            issuer=issuer,
+            audience=client_id,
+            options={'verify_aud': client_id is not None}
+        )
+
+    return verify
+
+def resolve_verifier(spec):
+    """Resolve --verifier: 'cognito', 'unverified' ou 'modulo:funcao'"""
+    if spec == 'unverified':
+        logger.warning("JWT signatures are NOT verified; use only for local testing")
+        return unverified_claims
+    if spec == 'cognito':
+        user_pool_id = os.environ.get('COGNITO_USER_POOL_ID')
+        if not user_pool_id:
+            raise SystemExit("COGNITO_USER_POOL_ID is required for the cognito verifier")
+        return cognito_verifier(user_pool_id, os.environ.get('COGNITO_CLIENT_ID'))
+    module_name, _, function_name = spec.partition(':')
+    return getattr(importlib.import_module(module_name), function_name)
+
+def make_request_handler(expense_module, verify_token):
+
+    class ExpenseRequestHandler(BaseHTTPRequestHandler):
+        # HTTP/1.1 mantém a conexão aberta entre requisições (keep-alive)
+        protocol_version = 'HTTP/1.1'
+
+        def do_OPTIONS(self):
+            self.send_json(204, {}, '')
+
+        def do_GET(self):
+            self.dispatch('GET')
+
+        def do_POST(self):
+            self.dispatch('POST')
+
+        def do_PUT(self):
+            self.dispatch('PUT')
+
+        def do_DELETE(self):
+            self.dispatch('DELETE')
+
+        def dispatch(self, method):
+            path, _, query = self.path.partition('?')
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length).decode('utf-8') if length else None
+
+            if EXPENSES_ROUTE.match(path):
+                resource, path_parameters = '/expenses', {}
+            elif ITEM_PRICES_ROUTE.match(path):
+                resource = '/expenses/items/{item_name}'
+                path_parameters = {'item_name': urllib.parse.unquote(ITEM_PRICES_ROUTE.match(path).group('item_name'))}
+            else:
+                match = EXPENSE_ITEM_ROUTE.match(path)
+                if not match:
+                    self.send_json(404, {}, json.dumps({'message': 'Not Found'}))
+                    return
+                resource = '/expenses/{receipt_id}'
+                path_parameters = {'receipt_id': urllib.parse.unquote(match.group('receipt_id'))}
+
+            authorization = self.headers.get('Authorization', '')
+            token = authorization[7:] if authorization.lower().startswith('bearer ') else authorization
+            try:
+                claims = verify_token(token)
+            except Exception as e:
+                logger.warning(f"Rejected token: {str(e)}")
+                self.send_json(401, {}, json.dumps({'message': 'Unauthorized'}))
+                return
+
+            # Mesmo formato de evento do API Gateway v1.0 com o autorizador Cognito
+            event = {
+                'httpMethod': method,
+                'resource': resource,
+                'path': path,
+                'pathParameters': path_parameters or None,
+                'queryStringParameters': dict(urllib.parse.parse_qsl(query)) or None,
+                'headers': dict(self.headers),
+                'body': body,
+                'requestContext': {'authorizer': {'claims': claims}}
+            }
+            try:
+                response = expense_module.lambda_handler(event, None)
+            except Exception as e:
+                # Mesmo comportamento do API Gateway: erro não tratado vira 500, sem fechar a conexão
+                logger.exception(f"Unhandled error in expense handler: {str(e)}")
+                self.send_json(500, {}, json.dumps({'message': 'Internal server error'}))
+                return
+            self.send_json(response['statusCode'], response.get('headers') or {}, response.get('body') or '')
+
+        def send_json(self, status, headers, body):
+            payload = body.encode('utf-8') if isinstance(body, str) else body
+            self.send_response(status)
+            for name, value in {**CORS_HEADERS, 'Content-Type': 'application/json', **headers}.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return ExpenseRequestHandler
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor HTTP local para a API de despesas.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--verifier', default='cognito', help="'cognito', 'unverified' ou 'modulo:funcao'")
+    parser.add_argument('--max-pool-connections', type=int, default=50,
+                        help='Conexões do pool do cliente DynamoDB compartilhado pelas threads')
+    parser.add_argument('--log-level', default='WARNING', help='O handler registra cada evento em INFO')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    expense_module = load_expense_handler(args.max_pool_connections)
+    # O handler configura o logger raiz em INFO ao ser importado
+    logging.getLogger().setLevel(args.log_level)
+
+    server = ThreadingHTTPServer((args.host, args.port), make_request_handler(expense_module, resolve_verifier(args.verifier)))
+    server.daemon_threads = True
+    logger.warning(f"Serving expense API on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
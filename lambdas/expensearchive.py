@@ -0,0 +1,71 @@
+"""
+Formato dos arquivos de despesas antigas no S3, compartilhado por archive-expenses.py
+(gravação), pela Lambda get-put-expense (leitura transparente no GET) e por
+backfill-item-index.py.
+
+Cada objeto <EXPENSE_ARCHIVE_PREFIX><userId>/<ano>.json.gz contém a lista JSON
+(gzip) das despesas arquivadas do usuário naquele ano, em ordem de data decrescente.
+
+Deve ser incluído no pacote da Lambda get-put-expense, junto com dynamodbjson.py.
+"""
+import gzip
+import json
+import os
+from datetime import date, timedelta
+
+from botocore.exceptions import ClientError
+
+import dynamodbjson
+
+# Vazio desativa o arquivamento e a leitura dos arquivos
+EXPENSE_ARCHIVE_BUCKET = os.environ.get('EXPENSE_ARCHIVE_BUCKET', '')
+EXPENSE_ARCHIVE_PREFIX = os.environ.get('EXPENSE_ARCHIVE_PREFIX', 'expense-archive/')
+EXPENSE_ARCHIVE_HORIZON_DAYS = int(os.environ.get('EXPENSE_ARCHIVE_HORIZON_DAYS', '730'))
+
+def archive_cutoff_date(horizon_days=EXPENSE_ARCHIVE_HORIZON_DAYS):
+    """Despesas com data anterior a este dia (YYYY-MM-DD) são arquivadas no S3"""
+    return (date.today() - timedelta(days=horizon_days)).isoformat()
+
+def user_archive_prefix(user_id, prefix=EXPENSE_ARCHIVE_PREFIX):
+    return f"{prefix}{user_id}/"
+
+def expense_archive_key(user_id, year, prefix=EXPENSE_ARCHIVE_PREFIX):
+    """Chave S3 do arquivo de despesas de um usuário em um ano"""
+    return f"{user_archive_prefix(user_id, prefix)}{year}.json.gz"
+
+def list_archives(s3, bucket, prefix):
+    """Arquivos sob o prefixo: {chave: ETag}"""
+    archives = {}
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            archives[obj['Key']] = obj['ETag']
+    return archives
+
+def archive_year(key):
+    """Ano de um arquivo a partir da sua chave ('.../<ano>.json.gz')"""
+    return key.rsplit('/', 1)[-1].split('.', 1)[0]
+
+def read_archive(s3, bucket, key):
+    """Lê um arquivo: (ETag, despesas); (None, []) se ele ainda não existe"""
+    try:
+        response = s3.get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchKey':
+            raise
+        return None, []
+    return response['ETag'], json.loads(gzip.decompress(response['Body'].read()))
+
+def write_archive(s3, bucket, key, expenses, etag):
+    """
+    Grava um arquivo com escrita condicional: falha com PreconditionFailed se outro
+    processo o alterou desde a leitura que retornou 'etag' (None para um arquivo novo).
+    """
+    condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+    s3.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=gzip.compress(dynamodbjson.dumps_response(expenses).encode('utf-8')),
+        ContentType='application/json',
+        ContentEncoding='gzip',
+        **condition
+    )
@@ -2,19 +2,167 @@ import json
 import os
 import boto3
 import uuid
+import threading
+from collections import OrderedDict
 from datetime import datetime
 from boto3.dynamodb.conditions import Key, Attr # Import Attr for FilterExpression
 from botocore.exceptions import ClientError
 import logging
+import invocationmetrics
+import itemindex
+import expensearchive
+from dynamodbjson import dumps_response
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 dynamodb = boto3.resource('dynamodb')
+s3 = boto3.client('s3')
+invocationmetrics.instrument(dynamodb.meta.client)
+invocationmetrics.instrument(s3)
 DYNAMODB_TABLE = os.environ.get('DYNAMODB_TABLE', 'Receipts')
+# Chave de ordenação dos itens de progresso de arquivos ZIP (ver receiptprocessor.py)
+ARCHIVE_PROGRESS_DATE = 'ARCHIVE'
+# Esquema de chaves: 'legacy' (receipt_id/date + GSI), 'dual' (migração: grava nas duas tabelas e lê das duas)
+# ou 'user' (tabela particionada por usuário: PK userId, SK sort_key = 'date#receipt_id')
+KEY_SCHEMA = os.environ.get('KEY_SCHEMA', 'legacy')
+USER_TABLE = os.environ.get('USER_TABLE', 'ReceiptsByUser')
+if KEY_SCHEMA not in ('legacy', 'dual', 'user'):
+    raise ValueError(f"Invalid KEY_SCHEMA: {KEY_SCHEMA}")
+# Índice de preços por item (ver receiptprocessor.py); vazio desativa o índice e as rotas /expenses/items
+ITEM_INDEX_TABLE = os.environ.get('ITEM_INDEX_TABLE', '')
+TOP_ITEMS_DEFAULT_LIMIT = 10
+TOP_ITEMS_MAX_LIMIT = 100
+# Despesas mais antigas que o horizonte são movidas para o S3 por archive-expenses.py (ver expensearchive.py).
+# Arquivos (usuário/ano) já descomprimidos mantidos em memória entre invocações
+EXPENSE_ARCHIVE_CACHE_SIZE = int(os.environ.get('EXPENSE_ARCHIVE_CACHE_SIZE', '32'))
+_archive_cache = OrderedDict()
+_archive_cache_lock = threading.Lock()
+
+def user_sort_key(date, receipt_id):
+    """Chave de ordenação da tabela particionada por usuário: 'YYYY-MM-DD#receipt_id'"""
+    return f"{date}#{receipt_id}"
+
+def to_user_item(item):
+    """Converte um item do esquema legado para a tabela particionada por usuário"""
+    return dict(item, sort_key=user_sort_key(item['date'], item['receipt_id']))
+
+def query_all(table, **kwargs):
+    """Executa uma query seguindo a paginação (LastEvaluatedKey) e retorna todos os itens"""
+    items = []
+    while True:
+        response = table.query(**kwargs)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return items
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def date_range_condition(attribute, start_date, end_date, end_suffix=''):
+    """Condição de chave de ordenação para o período [start_date, end_date] (limites opcionais)"""
+    key = Key(attribute)
+    if start_date and end_date:
+        return key.between(start_date, end_date + end_suffix)
+    if start_date:
+        return key.gte(start_date)
+    if end_date:
+        return key.lte(end_date + end_suffix)
+    return None
+
+def user_key_condition(user_id, attribute, start_date=None, end_date=None, end_suffix=''):
+    condition = Key('userId').eq(user_id)
+    range_condition = date_range_condition(attribute, start_date, end_date, end_suffix)
+    return condition & range_condition if range_condition is not None else condition
+
+def fetch_user_expenses(table, user_table, user_id, start_date=None, end_date=None):
+    """Busca as despesas do usuário conforme o KEY_SCHEMA, ordenadas por data decrescente"""
+    items = []
+    if KEY_SCHEMA in ('dual', 'user'):
+        # Uma única partição, com leitura fortemente consistente
+        items = query_all(
+            user_table,
+            # sort_key = 'date#receipt_id': o sufixo inclui todos os recibos do último dia
+            KeyConditionExpression=user_key_condition(user_id, 'sort_key', start_date, end_date, '#\uffff'),
+            ConsistentRead=True,
+            ScanIndexForward=False
+        )
+        for item in items:
+            item.pop('sort_key', None)
+    if KEY_SCHEMA in ('legacy', 'dual'):
+        legacy_items = query_all(
+            table,
+            IndexName='userId-date-index',
+            KeyConditionExpression=user_key_condition(user_id, 'date', start_date, end_date),
+            ScanIndexForward=False
+        )
+        if KEY_SCHEMA == 'legacy':
+            return legacy_items
+        # Durante a migração, itens ainda não copiados só existem na tabela legada
+        migrated_ids = {item['receipt_id'] for item in items}
+        items.extend(item for item in legacy_items if item['receipt_id'] not in migrated_ids)
+        items.sort(key=lambda item: item['date'], reverse=True)
+    return items
+
+def load_archived_year(key, etag):
+    """Lê um arquivo usuário/ano do S3, reutilizando a cópia em cache enquanto o ETag não mudar"""
+    with _archive_cache_lock:
+        cached = _archive_cache.get(key)
+        if cached and cached[0] == etag:
+            _archive_cache.move_to_end(key)
+            return cached[1]
+    current_etag, expenses = expensearchive.read_archive(s3, expensearchive.EXPENSE_ARCHIVE_BUCKET, key)
+    if current_etag is None:
+        return expenses
+    with _archive_cache_lock:
+        _archive_cache[key] = (current_etag, expenses)
+        _archive_cache.move_to_end(key)
+        while len(_archive_cache) > EXPENSE_ARCHIVE_CACHE_SIZE:
+            _archive_cache.popitem(last=False)
+    return expenses
+
+def fetch_archived_expenses(user_id, start_date=None, end_date=None):
+    """Despesas arquivadas do usuário no período, lidas dos objetos dos anos correspondentes"""
+    # A listagem informa os anos arquivados e os ETags usados para validar o cache
+    archives = expensearchive.list_archives(
+        s3, expensearchive.EXPENSE_ARCHIVE_BUCKET, expensearchive.user_archive_prefix(user_id)
+    )
+
+    expenses = []
+    for key, etag in archives.items():
+        year = expensearchive.archive_year(key)
+        if (start_date and year < start_date[:4]) or (end_date and year > end_date[:4]):
+            continue
+        expenses.extend(
+            expense for expense in load_archived_year(key, etag)
+            if (not start_date or expense['date'] >= start_date) and (not end_date or expense['date'] <= end_date)
+        )
+    return expenses
+
+def update_item_index(old_expense, new_expense):
+    """Atualiza o índice de preços por item com a alteração de uma despesa (ver itemindex.py)"""
+    if not ITEM_INDEX_TABLE:
+        return
+    expense = new_expense or old_expense
+    # O índice é secundário: uma falha nele (inclusive itens malformados no corpo da
+    # requisição) não deve desfazer a operação principal nem transformá-la em erro 500
+    try:
+        itemindex.update_item_index(dynamodb.Table(ITEM_INDEX_TABLE), old_expense, new_expense)
+    except ClientError as e:
+        logger.error(f"DynamoDB ClientError updating item price index for user {expense.get('userId')}: {e.response['Error']['Message']}")
+    except Exception as e:
+        logger.error(f"Unexpected error updating item price index for user {expense.get('userId')}: {str(e)}")
 
 def lambda_handler(event, context):
+    """Ponto de entrada da Lambda: trata a requisição e emite as métricas da invocação"""
+    invocationmetrics.metrics.start()
+    try:
+        response = handle_request(event, context)
+        invocationmetrics.metrics.set_property('StatusCode', response.get('statusCode'))
+        return response
+    finally:
+        invocationmetrics.metrics.flush()
+
+def handle_request(event, context):
     """
     Handler principal para gerenciar despesas.
     Compatível com API Gateway v1.0 (REST API) e v2.0 (HTTP API).
@@ -97,6 +245,11 @@ def lambda_handler(event, context):
             'body': json.dumps({'message': 'Internal server error during event parsing', 'error': str(e)})
         }
 
+    query_parameters = event.get('queryStringParameters') or {}
+    request_path = event.get('path') or event.get('rawPath') or ''
+
+    invocationmetrics.metrics.set_property('Route', event.get('routeKey') or f"{http_method} {event.get('resource') or request_path}")
+
     logger.info(f"Detected HTTP Method: {http_method}")
     logger.info(f"Detected Path Parameters: {path_parameters}")
     logger.info(f"Detected Body (raw): {body}")
@@ -113,6 +266,7 @@ def lambda_handler(event, context):
         }
 
     table = dynamodb.Table(DYNAMODB_TABLE)
+    user_table = dynamodb.Table(USER_TABLE)
 
     # --- OBTEM O USER ID DO COGNITO AUTHORIZER ---
     user_id = None
@@ -168,25 +322,173 @@ def lambda_handler(event, context):
         }
     
     logger.info(f"Authenticated User ID: {user_id}")
+    invocationmetrics.metrics.set_property('userId', user_id)
 
     # === Resto do código permanece igual para GET, POST ===
     
-    if http_method == 'GET':
+    is_items_route = 'item_name' in path_parameters or path_parameters.get('receipt_id') == 'items' \
+        or request_path.rstrip('/').endswith('/expenses/items')
+
+    if http_method == 'GET' and is_items_route:
+        # Histórico de preços de um item (/expenses/items/{item_name}) ou itens mais comprados (/expenses/items)
+        if not ITEM_INDEX_TABLE:
+            return {
+                'statusCode': 404,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'message': 'Item price index is not enabled'})
+            }
+        index_table = dynamodb.Table(ITEM_INDEX_TABLE)
         try:
-            # This is correct as it uses the GSI (userId-date-index)
-            response = table.query(
-                IndexName='userId-date-index', 
-                KeyConditionExpression=Key('userId').eq(user_id),
-                ScanIndexForward=False
+            if path_parameters.get('item_name'):
+                item_key = itemindex.normalize_item_name(path_parameters['item_name'])
+                history = query_all(
+                    index_table,
+                    KeyConditionExpression=Key('pk').eq(f"{user_id}#{item_key}"),
+                    ScanIndexForward=True
+                )
+                result = {
+                    'item': item_key,
+                    'history': [{k: v for k, v in row.items() if k not in ('pk', 'sk')} for row in history]
+                }
+            else:
+                limit = int(query_parameters.get('limit') or TOP_ITEMS_DEFAULT_LIMIT)
+                if limit <= 0:
+                    raise ValueError(limit)
+                limit = min(limit, TOP_ITEMS_MAX_LIMIT)
+                summaries = query_all(
+                    index_table,
+                    KeyConditionExpression=Key('pk').eq(user_id) & Key('sk').begins_with(itemindex.SUMMARY_PREFIX)
+                )
+                summaries = [s for s in summaries if s.get('purchase_count', 0) > 0]
+                summaries.sort(key=lambda s: (s['purchase_count'], s.get('total_spent', 0)), reverse=True)
+                result = [
+                    {
+                        'item': summary['sk'][len(itemindex.SUMMARY_PREFIX):],
+                        'item_name': summary.get('item_name'),
+                        'purchase_count': summary['purchase_count'],
+                        'total_quantity': summary.get('total_quantity'),
+                        'total_spent': summary.get('total_spent')
+                    }
+                    for summary in summaries[:limit]
+                ]
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': dumps_response(result)
+            }
+        except ValueError:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'message': 'limit must be a positive integer'})
+            }
+        except ClientError as e:
+            logger.error(f"DynamoDB ClientError fetching item index for user {user_id}: {e.response['Error']['Message']}")
+            return {
+                'statusCode': 500,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'message': 'Failed to fetch item prices', 'error': e.response['Error']['Message']})
+            }
+        except Exception as e:
+            logger.error(f"Error fetching item index for user {user_id}: {str(e)}")
+            return {
+                'statusCode': 500,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'message': 'Failed to fetch item prices', 'error': str(e)})
+            }
+
+    elif http_method == 'GET' and (path_parameters.get('receipt_id') or '').startswith('archive-'):
+        # Progresso do processamento de um arquivo ZIP de recibos (gravado pelo receiptprocessor)
+        archive_receipt_id = path_parameters['receipt_id']
+        try:
+            response = table.get_item(
+                Key={'receipt_id': archive_receipt_id, 'date': ARCHIVE_PROGRESS_DATE},
+                ConsistentRead=True
             )
-            logger.info(f"Successfully fetched {len(response.get('Items', []))} items for user {user_id}")
+            progress_item = response.get('Item')
+            if not progress_item or progress_item.get('owner_id') != user_id:
+                logger.warning(f"Archive progress {archive_receipt_id} not found for user {user_id}")
+                return {
+                    'statusCode': 404,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'message': 'Archive not found'})
+                }
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': dumps_response({k: v for k, v in progress_item.items() if k != 'owner_id'})
+            }
+        except ClientError as e:
+            logger.error(f"DynamoDB ClientError fetching archive progress {archive_receipt_id}: {e.response['Error']['Message']}")
+            return {
+                'statusCode': 500,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'message': 'Failed to fetch archive progress', 'error': e.response['Error']['Message']})
+            }
+
+    elif http_method == 'GET':
+        # Período opcional (YYYY-MM-DD); sem ele são retornadas apenas as despesas do DynamoDB
+        start_date = query_parameters.get('startDate')
+        end_date = query_parameters.get('endDate')
+        try:
+            for value in (start_date, end_date):
+                if value:
+                    datetime.strptime(value, '%Y-%m-%d')
+        except ValueError:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'message': 'startDate and endDate must use the YYYY-MM-DD format'})
+            }
+        try:
+            expenses = fetch_user_expenses(table, user_table, user_id, start_date, end_date)
+            reaches_archive = (start_date or end_date) and (not start_date or start_date < expensearchive.archive_cutoff_date())
+            if expensearchive.EXPENSE_ARCHIVE_BUCKET and reaches_archive:
+                # Despesas ainda não removidas do DynamoDB têm precedência sobre a cópia arquivada
+                fetched_ids = {expense['receipt_id'] for expense in expenses}
+                archived = [
+                    expense for expense in fetch_archived_expenses(user_id, start_date, end_date)
+                    if expense['receipt_id'] not in fetched_ids
+                ]
+                if archived:
+                    expenses.extend(archived)
+                    expenses.sort(key=lambda expense: expense['date'], reverse=True)
+                logger.info(f"Read {len(archived)} archived items for user {user_id}")
+            logger.info(f"Successfully fetched {len(expenses)} items for user {user_id} (key schema: {KEY_SCHEMA})")
             return {
                 'statusCode': 200,
                 'headers': {
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps(response.get('Items', []), default=str)
+                'body': dumps_response(expenses)
             }
         except ClientError as e:
             logger.error(f"DynamoDB ClientError fetching expenses for user {user_id}: {e.response['Error']['Message']}")
@@ -261,7 +563,11 @@ def lambda_handler(event, context):
                 db_item['category'] = request_body_parsed['category']
             
             logger.info(f"Attempting to put item: {db_item}")
-            table.put_item(Item=db_item)
+            if KEY_SCHEMA in ('legacy', 'dual'):
+                table.put_item(Item=db_item)
+            if KEY_SCHEMA in ('dual', 'user'):
+                user_table.put_item(Item=to_user_item(db_item))
+            update_item_index(None, db_item)
             logger.info(f"Expense {receipt_id} added successfully for user {user_id}")
 
             return {
@@ -351,43 +657,6 @@ def lambda_handler(event, context):
                     'body': json.dumps({'message': 'Date is required in the request body to update an expense.'})
                 }
 
-            try:
-                logger.info(f"Attempting to verify ownership for receipt_id: {receipt_id}, date: {item_date} for user: {user_id}")
-                
-                # *** FIX: Query the GSI (userId-date-index) to confirm ownership and existence of the item ***
-                # *** Use 'date' in KeyConditionExpression and 'receipt_id' in FilterExpression ***
-                gsi_response = table.query(
-                    IndexName='userId-date-index',
-                    KeyConditionExpression=Key('userId').eq(user_id) & Key('date').eq(item_date), # <--- CORREÇÃO AQUI
-                    FilterExpression=Attr('receipt_id').eq(receipt_id) # <--- CORREÇÃO AQUI
-                )
-                existing_items_gsi = gsi_response.get('Items', [])
-
-                if not existing_items_gsi:
-                    logger.warning(f"Expense {receipt_id} with date {item_date} not found for update for user {user_id} via GSI lookup.")
-                    return {
-                        'statusCode': 404,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'body': json.dumps({'message': 'Expense not found or you do not have permission to update it'})
-                    }
-                
-                # If we get here, an item matching user_id, receipt_id, and date was found.
-                # No need for the separate 'if existing_item.get('userId') != user_id:' check.
-
-            except ClientError as e:
-                logger.error(f"DynamoDB ClientError checking existing item {receipt_id} for user {user_id}: {e.response['Error']['Message']}")
-                return {
-                    'statusCode': 500,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'message': 'Failed to verify expense existence', 'error': e.response['Error']['Message']})
-                }
-
             update_expression_parts = []
             expression_attribute_values = {}
             expression_attribute_names = {}
@@ -421,14 +690,49 @@ def lambda_handler(event, context):
             logger.info(f"Expression Attribute Names: {expression_attribute_names}")
             logger.info(f"Expression Attribute Values: {expression_attribute_values}")
 
-            # Use the actual primary key (receipt_id and date) for update_item
-            response = table.update_item(
-                Key={'receipt_id': receipt_id, 'date': item_date},
-                UpdateExpression=update_expression,
-                ExpressionAttributeNames=expression_attribute_names,
-                ExpressionAttributeValues=expression_attribute_values,
-                ReturnValues='ALL_NEW'
-            )
+            # A condição confirma a existência e a propriedade do item na mesma escrita (na tabela
+            # por usuário a própria chave garante a propriedade). ALL_OLD: a versão antiga, lida de
+            # forma consistente, é necessária para o índice de preços; a nova é montada abaixo
+            if KEY_SCHEMA == 'user':
+                update_table = user_table
+                item_key = {'userId': user_id, 'sort_key': user_sort_key(item_date, receipt_id)}
+                ownership = Attr('userId').exists()
+            else:
+                update_table = table
+                item_key = {'receipt_id': receipt_id, 'date': item_date}
+                ownership = Attr('userId').eq(user_id)
+            try:
+                response = update_table.update_item(
+                    Key=item_key,
+                    UpdateExpression=update_expression,
+                    ConditionExpression=ownership,
+                    ExpressionAttributeNames=expression_attribute_names,
+                    ExpressionAttributeValues=expression_attribute_values,
+                    ReturnValues='ALL_OLD'
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                logger.warning(f"Expense {receipt_id} with date {item_date} not found for update for user {user_id}.")
+                return {
+                    'statusCode': 404,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'message': 'Expense not found or you do not have permission to update it'})
+                }
+            old_expense = response['Attributes']
+            old_expense.pop('sort_key', None)
+            new_expense = dict(old_expense, updated_timestamp=expression_attribute_values[':updated_val'])
+            for field in updatable_fields:
+                if field in request_body_parsed:
+                    new_expense[field] = request_body_parsed[field]
+            if KEY_SCHEMA == 'dual':
+                # Grava o item completo, o que também migra itens ainda não copiados
+                user_table.put_item(Item=to_user_item(new_expense))
+            response = {'Attributes': new_expense}
+            update_item_index(old_expense, response['Attributes'])
             logger.info(f"Expense {receipt_id} updated successfully for user {user_id}. New item: {response.get('Attributes')}")
 
             return {
@@ -437,7 +741,7 @@ def lambda_handler(event, context):
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({'message': 'Expense updated successfully', 'updated_item': response.get('Attributes')}, default=str)
+                'body': dumps_response({'message': 'Expense updated successfully', 'updated_item': response.get('Attributes')})
             }
 
         except json.JSONDecodeError:
@@ -517,20 +821,18 @@ def lambda_handler(event, context):
 
             logger.info(f"Attempting to delete expense with receipt_id: {receipt_id}, date: {item_date_from_request} for user: {user_id}")
             
-            # *** Verificação de Propriedade: Query o GSI (userId-date-index) ***
-            # Isto ainda é necessário porque o DynamoDB não tem uma operação de delete_item
-            # que possa verificar a propriedade baseada em um atributo não-chave (userId).
-            # Precisamos garantir que o usuário é o dono do item antes de tentar deletá-lo.
-            try:
-                gsi_response = table.query(
-                    IndexName='userId-date-index',
-                    KeyConditionExpression=Key('userId').eq(user_id) & Key('date').eq(item_date_from_request), # <--- AGORA O 'date' ESTÁ NO LUGAR CERTO (KeyConditionExpression)
-                    FilterExpression=Attr('receipt_id').eq(receipt_id) # <--- 'receipt_id' pode ficar no FilterExpression, pois NÃO é chave deste GSI.
-                )
-                gsi_items = gsi_response.get('Items', [])
-                
-                if not gsi_items:
-                    logger.warning(f"Expense {receipt_id} with date {item_date_from_request} not found for deletion for user {user_id} via GSI lookup.")
+            if KEY_SCHEMA == 'user':
+                # A chave (userId, sort_key) já restringe a deleção aos itens do usuário
+                try:
+                    response = user_table.delete_item(
+                        Key={'userId': user_id, 'sort_key': user_sort_key(item_date_from_request, receipt_id)},
+                        ConditionExpression=Attr('userId').exists(),
+                        ReturnValues='ALL_OLD'
+                    )
+                except ClientError as e:
+                    if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                        raise
+                    logger.warning(f"Expense {receipt_id} with date {item_date_from_request} not found for deletion for user {user_id}.")
                     return {
                         'statusCode': 404,
                         'headers': {
@@ -539,23 +841,41 @@ def lambda_handler(event, context):
                         },
                         'body': json.dumps({'message': 'Expense not found or you do not have permission to delete it'})
                     }
-                
-                # Se chegou aqui, o item foi encontrado e pertence ao usuário.
-                logger.info(f"Item confirmed to exist and belong to user. Proceeding with deletion.")
-                
-            except ClientError as e:
-                logger.error(f"DynamoDB ClientError verifying item ownership for deletion {receipt_id} for user {user_id}: {e.response['Error']['Message']}")
+                update_item_index(response['Attributes'], None)
+                logger.info(f"Expense {receipt_id} successfully deleted for user {user_id}.")
                 return {
-                    'statusCode': 500,
+                    'statusCode': 204,
                     'headers': {
                         'Content-Type': 'application/json',
                         'Access-Control-Allow-Origin': '*'
                     },
-                    'body': json.dumps({'message': 'Failed to verify expense ownership', 'error': e.response['Error']['Message']})
+                    'body': ''
                 }
 
-            # *** Executar a deleção com a chave primária completa ***
-            table.delete_item(Key={'receipt_id': receipt_id, 'date': item_date_from_request})
+            # A condição confirma a existência e a propriedade do item na própria deleção, e
+            # ALL_OLD devolve a versão apagada (lida de forma consistente) para o índice de preços.
+            # Duas deleções simultâneas não descontam a despesa duas vezes do índice.
+            try:
+                response = table.delete_item(
+                    Key={'receipt_id': receipt_id, 'date': item_date_from_request},
+                    ConditionExpression=Attr('userId').eq(user_id),
+                    ReturnValues='ALL_OLD'
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                logger.warning(f"Expense {receipt_id} with date {item_date_from_request} not found for deletion for user {user_id}.")
+                return {
+                    'statusCode': 404,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'message': 'Expense not found or you do not have permission to delete it'})
+                }
+            if KEY_SCHEMA == 'dual':
+                user_table.delete_item(Key={'userId': user_id, 'sort_key': user_sort_key(item_date_from_request, receipt_id)})
+            update_item_index(response['Attributes'], None)
             logger.info(f"Expense {receipt_id} successfully deleted for user {user_id}.")
 
             return {
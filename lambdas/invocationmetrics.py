@@ -0,0 +1,169 @@
+"""
+Métricas por invocação das chamadas AWS (DynamoDB, Textract, S3).
+
+instrument(client) registra handlers nos eventos do botocore do cliente, então
+todas as chamadas (inclusive as feitas por Table e batch_writer) são medidas sem
+alterar o código que as faz: latência, tentativas extras (retries), erros e, no
+DynamoDB, a capacidade consumida (ReturnConsumedCapacity é adicionado
+automaticamente). Ao final da invocação, flush() imprime uma linha JSON no
+CloudWatch Embedded Metric Format por operação.
+
+Deve ser incluído no pacote das Lambdas get-put-expense e receiptprocessor.
+"""
+import json
+import os
+import threading
+import time
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'ExpenseTracker')
+FUNCTION_NAME = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+
+# Operações do DynamoDB que aceitam ReturnConsumedCapacity
+READ_OPERATIONS = {'Query', 'Scan', 'GetItem', 'BatchGetItem', 'TransactGetItems'}
+WRITE_OPERATIONS = {'PutItem', 'UpdateItem', 'DeleteItem', 'BatchWriteItem', 'TransactWriteItems'}
+# O EMF aceita no máximo 100 valores por métrica em uma linha
+EMF_MAX_VALUES = 100
+
+class InvocationMetrics:
+    """Acumula as métricas das chamadas AWS de uma invocação (thread-safe)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.active = False
+        self.operations = {}
+        self.properties = {}
+        self.started = None
+
+    def start(self, **properties):
+        """Inicia a coleta de uma invocação; chamadas fora de start/flush não são registradas"""
+        with self._lock:
+            self.active = METRICS_ENABLED
+            self.operations = {}
+            self.properties = dict(properties)
+            self.started = time.perf_counter()
+
+    def set_property(self, name, value):
+        """Define um atributo da invocação (ex: Route, userId), incluído em todas as linhas"""
+        with self._lock:
+            self.properties[name] = value
+
+    def record(self, service, operation, latency_ms, retries=0, read_units=0.0, write_units=0.0, error=None):
+        with self._lock:
+            if not self.active:
+                return
+            stats = self.operations.setdefault((service, operation), {
+                'Calls': 0, 'Latency': [], 'Retries': 0, 'Errors': 0, 'ConsumedRCU': 0.0, 'ConsumedWCU': 0.0
+            })
+            stats['Calls'] += 1
+            stats['Latency'].append(round(latency_ms, 3))
+            stats['Retries'] += retries
+            stats['ConsumedRCU'] += read_units
+            stats['ConsumedWCU'] += write_units
+            if error:
+                stats['Errors'] += 1
+
+    def flush(self):
+        """Imprime as métricas acumuladas no formato EMF e encerra a coleta"""
+        with self._lock:
+            if not self.active:
+                return
+            self.active = False
+            operations, properties = self.operations, self.properties
+            duration_ms = (time.perf_counter() - self.started) * 1000
+
+        route = properties.get('Route', 'unknown')
+        emit_emf(['Function', 'Route'], {'Function': FUNCTION_NAME, 'Route': route},
+                 {'InvocationLatency': ([round(duration_ms, 3)], 'Milliseconds')}, properties)
+        for (service, operation), stats in operations.items():
+            dimensions = {'Function': FUNCTION_NAME, 'Route': route, 'Service': service, 'Operation': operation}
+            latencies = stats['Latency']
+            emit_emf(list(dimensions), dimensions, {
+                'Calls': (stats['Calls'], 'Count'),
+                'Latency': (latencies[:EMF_MAX_VALUES], 'Milliseconds'),
+                'Retries': (stats['Retries'], 'Count'),
+                'Errors': (stats['Errors'], 'Count'),
+                'ConsumedRCU': (stats['ConsumedRCU'], 'Count'),
+                'ConsumedWCU': (stats['ConsumedWCU'], 'Count')
+            }, properties)
+            for offset in range(EMF_MAX_VALUES, len(latencies), EMF_MAX_VALUES):
+                emit_emf(list(dimensions), dimensions,
+                         {'Latency': (latencies[offset:offset + EMF_MAX_VALUES], 'Milliseconds')}, properties)
+
+def emit_emf(dimension_names, dimensions, values, properties):
+    """Imprime uma linha EMF; print (e não logging) para que a linha seja JSON puro"""
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [dimension_names],
+                'Metrics': [{'Name': name, 'Unit': unit} for name, (_, unit) in values.items()]
+            }]
+        }
+    }
+    record.update(properties)
+    record.update(dimensions)
+    record.update({name: value for name, (value, _) in values.items()})
+    print(json.dumps(record, default=str))
+
+metrics = InvocationMetrics()
+
+def consumed_capacity(operation, parsed):
+    """Soma a capacidade consumida de uma resposta do DynamoDB: (RCU, WCU)"""
+    consumed = parsed.get('ConsumedCapacity')
+    if not consumed:
+        return 0.0, 0.0
+    entries = consumed if isinstance(consumed, list) else [consumed]
+    units = sum(float(entry.get('CapacityUnits', 0)) for entry in entries)
+    return (units, 0.0) if operation in READ_OPERATIONS else (0.0, units)
+
+def _request_consumed_capacity(params, model, **kwargs):
+    if model.name in READ_OPERATIONS or model.name in WRITE_OPERATIONS:
+        params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+def _start_timer(context, **kwargs):
+    context['metrics_started'] = time.perf_counter()
+
+def _elapsed_ms(context):
+    started = context.get('metrics_started')
+    return (time.perf_counter() - started) * 1000 if started is not None else 0.0
+
+def _after_call(service):
+    def handler(parsed, model, context, **kwargs):
+        latency_ms = _elapsed_ms(context)
+        read_units, write_units = consumed_capacity(model.name, parsed) if service == 'dynamodb' else (0.0, 0.0)
+        metrics.record(
+            service,
+            model.name,
+            latency_ms,
+            retries=parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0),
+            read_units=read_units,
+            write_units=write_units,
+            error=parsed.get('Error', {}).get('Code')
+        )
+    return handler
+
+def _after_call_error(service):
+    # Falhas sem resposta HTTP (ex: timeout de conexão); este evento não recebe o modelo da operação
+    def handler(exception, context, event_name, **kwargs):
+        latency_ms = _elapsed_ms(context)
+        metrics.record(service, event_name.rsplit('.', 1)[-1], latency_ms, error=type(exception).__name__)
+    return handler
+
+def instrument(client):
+    """Registra a coleta de métricas em um cliente boto3 (use resource.meta.client para resources)"""
+    if not METRICS_ENABLED:
+        return client
+    service = client.meta.service_model.service_name
+    events = client.meta.events
+    # unique_id torna a instrumentação idempotente se o mesmo cliente for instrumentado de novo
+    if service == 'dynamodb':
+        # register_first: o resource do boto3 troca os parâmetros por uma cópia neste mesmo evento
+        events.register_first('provide-client-params.dynamodb', _request_consumed_capacity,
+                        unique_id='invocationmetrics-capacity')
+    # O tempo começa a contar antes de outros handlers de before-call
+    events.register_first('before-call', _start_timer, unique_id='invocationmetrics-start')
+    events.register('after-call', _after_call(service), unique_id='invocationmetrics-after')
+    events.register('after-call-error', _after_call_error(service), unique_id='invocationmetrics-error')
+    return client
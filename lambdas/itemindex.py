@@ -0,0 +1,115 @@
+"""
+Índice de preços por item (ITEM_INDEX_TABLE), compartilhado pelas Lambdas.
+
+Cada item de linha de uma despesa vira uma linha de histórico (pk = 'userId#item',
+sk = 'date#receipt_id') e cada item do usuário tem um resumo (pk = userId,
+sk = 'ITEM#item') com contagem de compras, quantidade e gasto total, mantido com
+ADD a cada inclusão, alteração ou exclusão de despesa.
+
+Deve ser incluído no pacote das Lambdas get-put-expense e receiptprocessor.
+"""
+import re
+import unicodedata
+from decimal import Decimal, InvalidOperation
+
+SUMMARY_PREFIX = 'ITEM#'
+
+def normalize_item_name(name):
+    """Normaliza o nome de um item para agrupar compras: sem acentos, pontuação ou diferença de caixa"""
+    name = unicodedata.normalize('NFKD', name or '').encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(re.sub(r'[^\w]+', ' ', name).lower().split())
+
+def to_decimal(value, default):
+    """Converte preço/quantidade (string) para Decimal, com valor padrão se inválido"""
+    try:
+        number = Decimal(str(value).strip().replace(',', '.'))
+    except (InvalidOperation, ValueError):
+        return default
+    return number if number.is_finite() else default
+
+def item_index_entries(expense):
+    """Itens de linha da despesa agrupados por nome normalizado: {nome: {'name', 'price', 'quantity'}}"""
+    entries = {}
+    for item in expense.get('items') or []:
+        # Itens de linha malformados (ex: strings enviadas no POST/PUT) ficam fora do índice
+        if not isinstance(item, dict):
+            continue
+        key = normalize_item_name(item.get('name'))
+        if not key:
+            continue
+        entry = entries.setdefault(key, {'name': item['name'], 'price': Decimal('0'), 'quantity': Decimal('0')})
+        entry['price'] += to_decimal(item.get('price'), Decimal('0'))
+        entry['quantity'] += to_decimal(item.get('quantity'), Decimal('1'))
+    return entries
+
+def item_index_row(expense, key, entry):
+    """Item do índice de preços para um item de linha de uma despesa"""
+    row = {
+        'pk': f"{expense['userId']}#{key}",
+        'sk': f"{expense['date']}#{expense['receipt_id']}",
+        'item_name': entry['name'],
+        'price': entry['price'],
+        'quantity': entry['quantity'],
+        'date': expense['date'],
+        'receipt_id': expense['receipt_id'],
+        'vendor': expense.get('vendor', '')
+    }
+    if entry['quantity']:
+        row['unit_price'] = (entry['price'] / entry['quantity']).quantize(Decimal('0.01'))
+    return row
+
+def item_summary_key(user_id, key):
+    """Chave do resumo (contagem, quantidade e gasto total) de um item do usuário"""
+    return {'pk': user_id, 'sk': f"{SUMMARY_PREFIX}{key}"}
+
+def add_to_summary(table, user_id, key, name, count, quantity, spent):
+    """Soma (ou subtrai, com valores negativos) uma variação ao resumo de um item"""
+    table.update_item(
+        Key=item_summary_key(user_id, key),
+        UpdateExpression="SET item_name = :name ADD purchase_count :count, total_quantity :quantity, total_spent :spent",
+        ExpressionAttributeValues={
+            ':name': name,
+            ':count': count,
+            ':quantity': quantity,
+            ':spent': spent
+        }
+    )
+
+def update_item_index(table, old_expense, new_expense):
+    """
+    Aplica ao índice a diferença entre a versão antiga e a nova de uma despesa
+    (old_expense=None para inclusão, new_expense=None para exclusão).
+    """
+    expense = new_expense or old_expense
+    if not expense.get('userId'):
+        return
+    old_entries = item_index_entries(old_expense) if old_expense else {}
+    new_entries = item_index_entries(new_expense) if new_expense else {}
+    old_rows = {key: item_index_row(old_expense, key, entry) for key, entry in old_entries.items()}
+    new_rows = {key: item_index_row(new_expense, key, entry) for key, entry in new_entries.items()}
+
+    with table.batch_writer() as batch:
+        for key, row in old_rows.items():
+            # Uma linha antiga também sai do índice quando a data da despesa muda (nova sk)
+            new_row = new_rows.get(key)
+            if new_row is None or (new_row['pk'], new_row['sk']) != (row['pk'], row['sk']):
+                batch.delete_item(Key={'pk': row['pk'], 'sk': row['sk']})
+        for key, row in new_rows.items():
+            if old_rows.get(key) != row:
+                batch.put_item(Item=row)
+
+    zero = {'price': Decimal('0'), 'quantity': Decimal('0')}
+    for key in old_entries.keys() | new_entries.keys():
+        old_entry = old_entries.get(key)
+        new_entry = new_entries.get(key)
+        if old_entry == new_entry:
+            continue
+        add_to_summary(
+            table,
+            expense['userId'],
+            key,
+            (new_entry or old_entry)['name'],
+            (1 if new_entry else 0) - (1 if old_entry else 0),
+            (new_entry or zero)['quantity'] - (old_entry or zero)['quantity'],
+            (new_entry or zero)['price'] - (old_entry or zero)['price']
+        )
@@ -0,0 +1,134 @@
+"""
+Migração online da tabela legada (PK receipt_id, SK date) para a tabela particionada
+por usuário (PK userId, SK sort_key = 'date#receipt_id').
+
+Uso, com as Lambdas em KEY_SCHEMA=dual:
+    python migrate-key-schema.py --source Receipts --target ReceiptsByUser --segments 8
+    python migrate-key-schema.py --source Receipts --target ReceiptsByUser --verify
+
+A cópia usa put_item condicional (attribute_not_exists), então itens já gravados
+pelas Lambdas em modo dual nunca são sobrescritos por dados antigos do scan, e o
+script pode ser executado novamente com segurança. O modo --verify remove da tabela
+nova os itens que não existem mais na tabela legada (deletados durante a cópia).
+Depois da verificação, mude KEY_SCHEMA para 'user'.
+"""
+import argparse
+import threading
+import time
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+
+import receiptprocessor
+
+# Máximo de chaves por chamada BatchGetItem
+BATCH_GET_LIMIT = 100
+
+class Counters:
+    """Contadores compartilhados entre os segmentos do scan"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = {}
+
+    def add(self, name, amount=1):
+        with self._lock:
+            self.values[name] = self.values.get(name, 0) + amount
+
+def copy_segment(source_name, target_name, segment, total_segments, counters, dry_run):
+    """Copia para a tabela nova os itens de um segmento da tabela legada"""
+    dynamodb = receiptprocessor.dynamodb_resource()
+    source, target = dynamodb.Table(source_name), dynamodb.Table(target_name)
+    for item in receiptprocessor.scan_segment(source, segment, total_segments):
+        counters.add('scanned')
+        # Itens de progresso de arquivos ZIP e recibos sem usuário não são despesas de ninguém
+        if not item.get('userId') or item['receipt_id'].startswith('archive-'):
+            counters.add('skipped')
+            continue
+        if dry_run:
+            counters.add('copied')
+            continue
+        try:
+            target.put_item(
+                Item=dict(item, sort_key=receiptprocessor.user_sort_key(item['date'], item['receipt_id'])),
+                ConditionExpression=Attr('userId').not_exists()
+            )
+            counters.add('copied')
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            counters.add('already_present')
+
+def existing_legacy_keys(dynamodb, source_name, keys):
+    """Quais chaves (receipt_id, date) existem na tabela legada, com um BatchGetItem consistente"""
+    found = set()
+    request_items = {
+        source_name: {
+            'Keys': keys,
+            'ProjectionExpression': 'receipt_id, #date',
+            'ExpressionAttributeNames': {'#date': 'date'},
+            'ConsistentRead': True
+        }
+    }
+    attempt = 0
+    while request_items:
+        response = dynamodb.batch_get_item(RequestItems=request_items)
+        found.update((item['receipt_id'], item['date']) for item in response['Responses'].get(source_name, []))
+        # Chaves não processadas (throttling) são reenviadas com backoff exponencial
+        request_items = response.get('UnprocessedKeys') or {}
+        if request_items:
+            attempt += 1
+            time.sleep(min(0.05 * 2 ** attempt, 2))
+    return found
+
+def verify_segment(source_name, target_name, segment, total_segments, counters, dry_run):
+    """Remove da tabela nova os itens cuja origem foi deletada da tabela legada"""
+    dynamodb = receiptprocessor.dynamodb_resource()
+    target = dynamodb.Table(target_name)
+
+    def verify_batch(batch):
+        existing = existing_legacy_keys(dynamodb, source_name,
+                                        [{'receipt_id': receipt_id, 'date': date} for receipt_id, date in batch])
+        for legacy_key, item in batch.items():
+            if legacy_key in existing:
+                continue
+            counters.add('orphaned')
+            if not dry_run:
+                target.delete_item(Key={'userId': item['userId'], 'sort_key': item['sort_key']})
+
+    batch = {}
+    for item in receiptprocessor.scan_segment(target, segment, total_segments,
+                             ProjectionExpression='userId, sort_key, receipt_id, #date',
+                             ExpressionAttributeNames={'#date': 'date'}):
+        counters.add('scanned')
+        batch[(item['receipt_id'], item['date'])] = item
+        if len(batch) == BATCH_GET_LIMIT:
+            verify_batch(batch)
+            batch = {}
+    if batch:
+        verify_batch(batch)
+
+def main():
+    parser = argparse.ArgumentParser(description='Migra despesas para a tabela particionada por usuário.')
+    parser.add_argument('--source', default='Receipts', help='Tabela legada (receipt_id/date)')
+    parser.add_argument('--target', default='ReceiptsByUser', help='Tabela nova (userId/sort_key)')
+    parser.add_argument('--segments', type=int, default=4, help='Segmentos do scan paralelo')
+    parser.add_argument('--verify', action='store_true', help='Remove da tabela nova itens deletados da legada')
+    parser.add_argument('--dry-run', action='store_true', help='Apenas conta, sem gravar')
+    args = parser.parse_args()
+
+    counters = Counters()
+    worker = verify_segment if args.verify else copy_segment
+
+    with ThreadPoolExecutor(max_workers=args.segments) as executor:
+        futures = [
+            executor.submit(worker, args.source, args.target, segment, args.segments, counters, args.dry_run)
+            for segment in range(args.segments)
+        ]
+        for future in futures:
+            future.result()
+
+    print(f"{'Verificação' if args.verify else 'Cópia'} concluída{' (dry-run)' if args.dry_run else ''}: {counters.values}")
+
+if __name__ == '__main__':
+    main()
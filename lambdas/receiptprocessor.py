@@ -6,14 +6,50 @@ import uuid
 from datetime import datetime
 import urllib.parse
 import re # Importar o módulo re para expressões regulares
+import io
+import gzip
+import zipfile
+import threading
+import mimetypes
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from boto3.dynamodb.conditions import Key, Attr
+import invocationmetrics
+import itemindex
 
 # Inicializa clientes AWS
 s3 = boto3.client('s3')
 textract = boto3.client('textract')
 dynamodb = boto3.resource('dynamodb')
+# Latência, retries e capacidade consumida de todas as chamadas AWS, por invocação
+invocationmetrics.instrument(s3)
+invocationmetrics.instrument(textract)
+invocationmetrics.instrument(dynamodb.meta.client)
+_thread_local = threading.local()
 
 # Variáveis de ambiente
 DYNAMODB_TABLE = os.environ.get('DYNAMODB_TABLE', 'Receipts')
+# Esquema de chaves: 'legacy' (receipt_id/date), 'dual' (grava nas duas tabelas) ou 'user' (userId/sort_key)
+KEY_SCHEMA = os.environ.get('KEY_SCHEMA', 'legacy')
+USER_TABLE = os.environ.get('USER_TABLE', 'ReceiptsByUser')
+if KEY_SCHEMA not in ('legacy', 'dual', 'user'):
+    raise ValueError(f"KEY_SCHEMA inválido: {KEY_SCHEMA}")
+# Processamento de arquivos ZIP com vários recibos
+ARCHIVE_MAX_WORKERS = int(os.environ.get('ARCHIVE_MAX_WORKERS', '8'))
+ARCHIVE_EXTRACT_PREFIX = os.environ.get('ARCHIVE_EXTRACT_PREFIX', 'archives/')
+ARCHIVE_PROGRESS_EVERY = int(os.environ.get('ARCHIVE_PROGRESS_EVERY', '10'))
+# Tamanho mínimo de cada leitura parcial (Range GET) feita no ZIP armazenado no S3
+ARCHIVE_READ_CHUNK = 1024 * 1024
+# Formatos aceitos pelo Textract AnalyzeExpense
+RECEIPT_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.pdf', '.tif', '.tiff')
+# Marcador de chave de ordenação (date) dos itens de progresso de arquivos ZIP
+ARCHIVE_PROGRESS_DATE = 'ARCHIVE'
+# Resposta bruta do Textract, comprimida, gravada para reprocessamento em <prefixo><chave do recibo>.json.gz,
+# fora do prefixo receipts/ da notificação do S3 (senão cada recibo dispararia uma segunda invocação)
+TEXTRACT_ARCHIVE_ENABLED = os.environ.get('TEXTRACT_ARCHIVE_ENABLED', 'true').lower() == 'true'
+TEXTRACT_ARCHIVE_PREFIX = os.environ.get('TEXTRACT_ARCHIVE_PREFIX', 'textract-archive/')
+# Índice de preços por item (PK pk = 'userId#item', SK sk = 'date#receipt_id'); vazio desativa o índice
+ITEM_INDEX_TABLE = os.environ.get('ITEM_INDEX_TABLE', '')
 
 def clean_and_format_number_string(value_str):
     """
@@ -53,26 +89,55 @@ def clean_and_format_number_string(value_str):
         return "0.00"
 
 def lambda_handler(event, context):
+    """Ponto de entrada da Lambda: processa o evento do S3 e emite as métricas da invocação"""
+    invocationmetrics.metrics.start(Route='ObjectCreated')
+    try:
+        return handle_s3_event(event, context)
+    finally:
+        invocationmetrics.metrics.flush()
+
+def handle_s3_event(event, context):
+    is_archive = False
     try:
         # Obter o bucket S3 e a chave do evento
         bucket = event['Records'][0]['s3']['bucket']['name']
         # Decodificar a URL da chave para lidar com espaços e caracteres especiais
         key = urllib.parse.unquote_plus(event['Records'][0]['s3']['object']['key'])
 
+        # Respostas do Textract arquivadas por esta própria Lambda não são recibos
+        # (só chegam aqui se a notificação não tiver o filtro de prefixo receipts/)
+        if key.startswith(TEXTRACT_ARCHIVE_PREFIX):
+            print(f"Objeto {key} é uma resposta arquivada do Textract. Ignorando.")
+            return {
+                'statusCode': 200,
+                'body': json.dumps('Resposta do Textract ignorada.')
+            }
+
         print(f"Processando recibo de {bucket}/{key}")
 
         user_id = None
+        object_metadata = {}
         # Tentar obter o userId dos metadados do objeto S3
         try:
             s3_object_metadata = s3.head_object(Bucket=bucket, Key=key)
             # Metadados são sempre retornados em minúsculas
-            user_id = s3_object_metadata['Metadata'].get('userid')
+            object_metadata = s3_object_metadata['Metadata']
+            user_id = object_metadata.get('userid')
+            invocationmetrics.metrics.set_property('userId', user_id)
             if not user_id:
                 print(f"Aviso: ID do usuário não encontrado nos metadados do objeto S3 para {key}. Prosseguindo sem associação de usuário.")
         except Exception as e:
             print(f"Erro ao obter metadados do objeto S3 para {key}: {str(e)}")
             user_id = None # Fallback se a busca de metadados falhar
 
+        # Recibos extraídos de um ZIP já foram processados pela invocação do arquivo
+        if object_metadata.get('archiveid'):
+            print(f"Objeto {key} extraído do arquivo {object_metadata['archiveid']}. Ignorando.")
+            return {
+                'statusCode': 200,
+                'body': json.dumps('Recibo de arquivo ZIP já processado.')
+            }
+
         # Verificar se o objeto existe antes de prosseguir
         try:
             s3.head_object(Bucket=bucket, Key=key)
@@ -81,6 +146,15 @@ def lambda_handler(event, context):
             print(f"Falha na verificação do objeto S3: {str(e)}")
             raise Exception(f"Não foi possível acessar o objeto {key} no bucket {bucket}: {str(e)}")
 
+        if key.lower().endswith('.zip'):
+            is_archive = True
+            invocationmetrics.metrics.set_property('Route', 'ObjectCreated:zip')
+            progress = process_receipt_archive(bucket, key, user_id)
+            return {
+                'statusCode': 200,
+                'body': json.dumps(progress)
+            }
+
         # Passo 1: Processar o recibo com o Textract
         receipt_data = process_receipt_with_textract(bucket, key)
 
@@ -94,12 +168,16 @@ def lambda_handler(event, context):
         }
     except Exception as e:
         print(f"Erro ao processar recibo: {str(e)}")
+        if is_archive:
+            # Relançada para que o Lambda tente de novo a invocação assíncrona do S3; a nova
+            # tentativa retoma o ZIP sem reprocessar as entradas já gravadas
+            raise
         return {
             'statusCode': 500,
             'body': json.dumps(f'Erro: {str(e)}')
         }
 
-def process_receipt_with_textract(bucket, key):
+def process_receipt_with_textract(bucket, key, receipt_id=None):
     """Processa o recibo usando a operação AnalyzeExpense do Textract"""
     try:
         print(f"Chamando Textract analyze_expense para {bucket}/{key}")
@@ -116,17 +194,52 @@ def process_receipt_with_textract(bucket, key):
         print(f"Chamada Textract analyze_expense falhou: {str(e)}")
         raise
 
-    # Gerar um ID único para este recibo
-    receipt_id = str(uuid.uuid4())
+    if TEXTRACT_ARCHIVE_ENABLED:
+        archive_textract_response(bucket, key, response)
+
+    receipt_data = parse_expense_response(response, datetime.now().strftime('%Y-%m-%d'))
+    # Gerar um ID único para este recibo (recibos de ZIP recebem um ID determinístico)
+    receipt_data['receipt_id'] = receipt_id or str(uuid.uuid4())
+    receipt_data['s3_path'] = f"s3://{bucket}/{key}"
+
+    print(f"Dados do recibo extraídos (após limpeza): {json.dumps(receipt_data)}")
+    return receipt_data
+
+def textract_archive_key(key):
+    """Chave S3 da resposta arquivada do Textract para o recibo em 'key'"""
+    return f"{TEXTRACT_ARCHIVE_PREFIX}{key}.json.gz"
+
+def archive_textract_response(bucket, key, response):
+    """Grava a resposta bruta do AnalyzeExpense (JSON + gzip) no S3, sob TEXTRACT_ARCHIVE_PREFIX"""
+    try:
+        raw = {k: v for k, v in response.items() if k != 'ResponseMetadata'}
+        s3.put_object(
+            Bucket=bucket,
+            Key=textract_archive_key(key),
+            Body=gzip.compress(json.dumps(raw).encode('utf-8')),
+            ContentType='application/json',
+            ContentEncoding='gzip'
+        )
+    except Exception as e:
+        # O arquivamento não deve impedir o processamento do recibo
+        print(f"AVISO: Não foi possível arquivar a resposta do Textract para {key}: {str(e)}")
+
+def load_textract_response(bucket, key):
+    """Lê a resposta arquivada do Textract para o recibo em 'key'"""
+    body = s3.get_object(Bucket=bucket, Key=textract_archive_key(key))['Body'].read()
+    return json.loads(gzip.decompress(body))
 
+def parse_expense_response(response, default_date):
+    """
+    Extrai data, vendedor, total e itens de uma resposta do AnalyzeExpense.
+    'default_date' é usada quando a data não é encontrada ou não pode ser interpretada.
+    """
     # Inicializar o dicionário de dados do recibo
     receipt_data = {
-        'receipt_id': receipt_id,
-        'date': datetime.now().strftime('%Y-%m-%d'),  # Data padrão
+        'date': default_date,
         'vendor': 'Desconhecido',
         'total': '0.00', # Inicializa, será sobrescrito
-        'items': [],
-        's3_path': f"s3://{bucket}/{key}"
+        'items': []
     }
 
     # Extrair dados da resposta do Textract
@@ -166,9 +279,9 @@ def process_receipt_with_textract(bucket, key):
                             receipt_data['date'] = parsed_date.strftime('%Y-%m-%d')
                         except ValueError:
                             print(f"AVISO: Não foi possível parsear a data do Textract '{value}'. Usando data padrão.")
-                            receipt_data['date'] = datetime.now().strftime('%Y-%m-%d')
+                            receipt_data['date'] = default_date
                     else:
-                        receipt_data['date'] = datetime.now().strftime('%Y-%m-%d')
+                        receipt_data['date'] = default_date
                 elif field_type == 'VENDOR_NAME':
                     receipt_data['vendor'] = value
 
@@ -196,39 +309,335 @@ def process_receipt_with_textract(bucket, key):
                             item['quantity'] = item.get('quantity', '1')
                             receipt_data['items'].append(item)
 
-    print(f"Dados do recibo extraídos (após limpeza): {json.dumps(receipt_data)}")
     return receipt_data
 
+def build_receipt_db_item(receipt_data, user_id=None):
+    """Monta o item do DynamoDB a partir dos dados extraídos do recibo"""
+    # Os itens já foram limpos e formatados para o padrão americano pela função process_receipt_with_textract
+    items_for_db = []
+    for item in receipt_data['items']:
+        items_for_db.append({
+            'name': item.get('name', 'Unknown Item'),
+            'price': item.get('price', '0.00'), # Já deve estar limpo e formatado
+            'quantity': item.get('quantity', '1')
+        })
+
+    # Criar item para inserção
+    db_item = {
+        'receipt_id': receipt_data['receipt_id'],
+        'date': receipt_data['date'], # Deve estar no formato YYYY-MM-DD
+        'vendor': receipt_data['vendor'],
+        'total': receipt_data['total'], # Já deve estar limpo e formatado
+        'items': items_for_db,
+        's3_path': receipt_data['s3_path'],
+        'processed_timestamp': datetime.now().isoformat()
+    }
+    if user_id: # Adicionar userId se presente nos metadados do S3
+        db_item['userId'] = user_id
+    return db_item
+
+def dynamodb_resource():
+    """
+    Resource do DynamoDB para a thread atual. Resources do boto3 não são thread-safe (os
+    clientes são): a thread principal usa o do módulo e as demais criam o seu, em uma sessão própria.
+    """
+    if threading.current_thread() is threading.main_thread():
+        return dynamodb
+    resource = getattr(_thread_local, 'dynamodb', None)
+    if resource is None:
+        resource = _thread_local.dynamodb = boto3.session.Session().resource('dynamodb')
+        invocationmetrics.instrument(resource.meta.client)
+    return resource
+
+def user_sort_key(date, receipt_id):
+    """Chave de ordenação da tabela particionada por usuário: 'YYYY-MM-DD#receipt_id'"""
+    return f"{date}#{receipt_id}"
+
+def receipt_tables():
+    """Tabelas que recebem os recibos no KEY_SCHEMA atual, como pares (tabela, particionada_por_usuario)"""
+    tables = []
+    if KEY_SCHEMA in ('legacy', 'dual'):
+        tables.append((dynamodb_resource().Table(DYNAMODB_TABLE), False))
+    if KEY_SCHEMA in ('dual', 'user'):
+        tables.append((dynamodb_resource().Table(USER_TABLE), True))
+    return tables
+
+def source_table():
+    """Tabela que é a fonte de verdade das despesas: a legada em 'legacy'/'dual', a por usuário em 'user'"""
+    return receipt_tables()[0][0]
+
+def item_for_table(db_item, user_partitioned):
+    """Adapta o item ao esquema da tabela; retorna None se ele não puder ser gravado nela"""
+    if not user_partitioned:
+        return db_item
+    if not db_item.get('userId'):
+        # Sem userId não há chave de partição na tabela particionada por usuário
+        return None
+    return dict(db_item, sort_key=user_sort_key(db_item['date'], db_item['receipt_id']))
+
+def table_key(item, user_partitioned):
+    """Chave primária do item na tabela legada ou na particionada por usuário"""
+    if user_partitioned:
+        return {'userId': item['userId'], 'sort_key': user_sort_key(item['date'], item['receipt_id'])}
+    return {'receipt_id': item['receipt_id'], 'date': item['date']}
+
+# Atributos que mudam quando uma despesa é criada, editada (PUT) ou reprocessada
+VERSION_ATTRIBUTES = ('processed_timestamp', 'updated_timestamp', 'reprocessed_timestamp')
+
+def unchanged_condition(item):
+    """Condição de escrita: a linha não foi criada de novo, editada nem reprocessada desde a leitura de 'item'"""
+    condition = None
+    for name in VERSION_ATTRIBUTES:
+        clause = Attr(name).eq(item[name]) if name in item else Attr(name).not_exists()
+        condition = clause if condition is None else condition & clause
+    return condition
+
+def query_all(table, **kwargs):
+    """Executa uma query seguindo a paginação (LastEvaluatedKey) e retorna todos os itens"""
+    items = []
+    while True:
+        response = table.query(**kwargs)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return items
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def scan_segment(table, segment=0, total_segments=1, **kwargs):
+    """Percorre um scan (ou um segmento de um scan paralelo), página por página"""
+    if total_segments > 1:
+        kwargs.update(Segment=segment, TotalSegments=total_segments)
+    while True:
+        response = table.scan(**kwargs)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
 def store_receipt_in_dynamodb(receipt_data, bucket, key, user_id=None):
     """Armazena os dados do recibo extraídos no DynamoDB"""
     try:
-        table = dynamodb.Table(DYNAMODB_TABLE)
-
-        # Os itens já foram limpos e formatados para o padrão americano pela função process_receipt_with_textract
-        items_for_db = []
-        for item in receipt_data['items']:
-            items_for_db.append({
-                'name': item.get('name', 'Unknown Item'),
-                'price': item.get('price', '0.00'), # Já deve estar limpo e formatado
-                'quantity': item.get('quantity', '1')
-            })
-
-        # Criar item para inserção
-        db_item = {
-            'receipt_id': receipt_data['receipt_id'],
-            'date': receipt_data['date'], # Deve estar no formato YYYY-MM-DD
-            'vendor': receipt_data['vendor'],
-            'total': receipt_data['total'], # Já deve estar limpo e formatado
-            'items': items_for_db,
-            's3_path': receipt_data['s3_path'],
-            'processed_timestamp': datetime.now().isoformat()
-        }
-        if user_id: # Adicionar userId se presente nos metadados do S3
-            db_item['userId'] = user_id
+        db_item = build_receipt_db_item(receipt_data, user_id)
 
-        # Inserir no DynamoDB
-        table.put_item(Item=db_item)
+        # Inserir no DynamoDB (nas duas tabelas durante a migração de esquema)
+        for table, user_partitioned in receipt_tables():
+            table_item = item_for_table(db_item, user_partitioned)
+            if table_item is None:
+                print(f"Aviso: recibo {receipt_data['receipt_id']} sem userId não pode ser gravado em {table.name}.")
+                continue
+            table.put_item(Item=table_item)
+        index_expense_items(db_item)
         print(f"Dados do recibo armazenados no DynamoDB: {receipt_data['receipt_id']}")
     except Exception as e:
         print(f"Erro ao armazenar dados no DynamoDB: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+
+def index_expense_items(expense):
+    """Grava os itens de linha de uma nova despesa no índice de preços e atualiza os resumos"""
+    if not ITEM_INDEX_TABLE or not expense.get('userId'):
+        return
+    # O índice é secundário: uma falha nele não deve impedir o armazenamento do recibo
+    try:
+        itemindex.update_item_index(dynamodb_resource().Table(ITEM_INDEX_TABLE), None, expense)
+    except Exception as e:
+        print(f"Erro ao atualizar o índice de preços para {expense['receipt_id']}: {str(e)}")
+
+class S3RangeReader(io.RawIOBase):
+    """
+    Arquivo somente leitura e "seekable" sobre um objeto S3, usando Range GETs.
+    Permite que o zipfile leia o diretório central e cada entrada sob demanda,
+    sem baixar o arquivo inteiro para a memória. Deve ser envolvido por um
+    io.BufferedReader para agrupar leituras pequenas em blocos de ARCHIVE_READ_CHUNK.
+    """
+
+    def __init__(self, bucket, key, size):
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        self.position = max(0, min(self.position, self.size))
+        return self.position
+
+    def readinto(self, b):
+        if self.position >= self.size or len(b) == 0:
+            return 0
+        end = min(self.position + len(b), self.size) - 1
+        response = s3.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={self.position}-{end}")
+        data = response['Body'].read()
+        b[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+def archive_progress_key(archive_id):
+    """Chave primária do item de progresso de um arquivo ZIP"""
+    return {'receipt_id': f"archive-{archive_id}", 'date': ARCHIVE_PROGRESS_DATE}
+
+def archive_entry_receipt_id(archive_id, index):
+    """receipt_id determinístico de uma entrada do ZIP, para que reprocessar o arquivo não duplique despesas"""
+    return f"{archive_id}-{index:04d}"
+
+def stored_archive_receipt_ids(archive_id, receipt_ids, user_id):
+    """Quais receipt_ids das entradas de um ZIP já estão gravados (retomada de um processamento interrompido)"""
+    table, user_partitioned = source_table(), KEY_SCHEMA == 'user'
+    if user_id:
+        index = {} if user_partitioned else {'IndexName': 'userId-date-index'}
+        items = query_all(
+            table,
+            KeyConditionExpression=Key('userId').eq(user_id),
+            FilterExpression=Attr('receipt_id').begins_with(f"{archive_id}-"),
+            ProjectionExpression='receipt_id',
+            **index
+        )
+        return {item['receipt_id'] for item in items} & set(receipt_ids)
+    if user_partitioned:
+        # Recibos sem userId não são gravados na tabela particionada por usuário
+        return set()
+    # Sem userId os recibos não aparecem no GSI: consulta cada um pela chave de partição da tabela legada
+    return {
+        receipt_id for receipt_id in receipt_ids
+        if table.query(KeyConditionExpression=Key('receipt_id').eq(receipt_id), Select='COUNT', Limit=1)['Count']
+    }
+
+def process_archive_entry(bucket, entry_key, content, user_id, archive_id, receipt_id):
+    """Envia uma entrada do ZIP para o S3, processa-a com o Textract e retorna o item do DynamoDB"""
+    metadata = {'archiveid': archive_id}
+    if user_id:
+        metadata['userid'] = user_id
+    s3.put_object(
+        Bucket=bucket,
+        Key=entry_key,
+        Body=content,
+        ContentType=mimetypes.guess_type(entry_key)[0] or 'application/octet-stream',
+        Metadata=metadata
+    )
+    db_item = build_receipt_db_item(process_receipt_with_textract(bucket, entry_key, receipt_id), user_id)
+    # O índice de preços usa update_item por item, então é atualizado em paralelo, fora da thread principal
+    # (com o resource da própria thread, ver dynamodb_resource)
+    index_expense_items(db_item)
+    return db_item
+
+def process_receipt_archive(bucket, key, user_id=None):
+    """
+    Processa um arquivo ZIP com vários recibos: lê as entradas do S3 sob demanda,
+    processa-as em paralelo com o Textract e grava os resultados em lote no DynamoDB.
+    O progresso fica em um item do próprio DynamoDB que o cliente pode consultar.
+    """
+    table = dynamodb_resource().Table(DYNAMODB_TABLE)
+    archive_id = os.path.splitext(os.path.basename(key))[0]
+    progress_key = archive_progress_key(archive_id)
+
+    size = s3.head_object(Bucket=bucket, Key=key)['ContentLength']
+    with zipfile.ZipFile(io.BufferedReader(S3RangeReader(bucket, key, size), ARCHIVE_READ_CHUNK)) as archive:
+        entries = [
+            info for info in archive.infolist()
+            if not info.is_dir()
+            and not os.path.basename(info.filename).startswith('.')
+            and info.filename.lower().endswith(RECEIPT_EXTENSIONS)
+        ]
+        receipt_ids = [archive_entry_receipt_id(archive_id, index) for index in range(len(entries))]
+        # Em uma nova tentativa (ex: após timeout ou falha), as entradas já gravadas não são processadas
+        # de novo. Só há o que procurar se uma tentativa anterior já criou o item de progresso.
+        stored_ids = set()
+        if 'Item' in table.get_item(Key=progress_key, ConsistentRead=True, ProjectionExpression='receipt_id'):
+            stored_ids = stored_archive_receipt_ids(archive_id, receipt_ids, user_id)
+        print(f"Arquivo {key} contém {len(entries)} recibos ({len(stored_ids)} já processados)")
+
+        # O item de progresso fica sempre em DYNAMODB_TABLE, sem 'userId' para não aparecer no GSI userId-date-index
+        progress = {
+            'archive_id': archive_id,
+            'status': 'PROCESSING',
+            'total': len(entries),
+            'processed': len(stored_ids),
+            'skipped': len(stored_ids),
+            'failed': 0
+        }
+        progress_item = dict(progress_key, owner_id=user_id or '', s3_path=f"s3://{bucket}/{key}",
+                             started_timestamp=datetime.now().isoformat(), **progress)
+        table.put_item(Item=progress_item)
+
+        def update_progress(status):
+            progress['status'] = status
+            table.update_item(
+                Key=progress_key,
+                UpdateExpression="SET #status = :status, processed = :processed, failed = :failed, updated_timestamp = :updated",
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={
+                    ':status': status,
+                    ':processed': progress['processed'],
+                    ':failed': progress['failed'],
+                    ':updated': datetime.now().isoformat()
+                }
+            )
+
+        # Apenas a thread principal lê o ZIP e grava nos batch_writers (nenhum dos dois é thread-safe);
+        # o número de entradas em memória é limitado pelo número de tarefas pendentes.
+        max_pending = ARCHIVE_MAX_WORKERS * 2
+        pending = {}
+        completed_since_update = 0
+        try:
+            with ExitStack() as stack:
+                writers = [(stack.enter_context(receipt_table.batch_writer()), user_partitioned)
+                           for receipt_table, user_partitioned in receipt_tables()]
+                executor = stack.enter_context(ThreadPoolExecutor(max_workers=ARCHIVE_MAX_WORKERS))
+
+                def collect(done):
+                    nonlocal completed_since_update
+                    for future in done:
+                        entry_name = pending.pop(future)
+                        try:
+                            db_item = future.result()
+                            for writer, user_partitioned in writers:
+                                table_item = item_for_table(db_item, user_partitioned)
+                                if table_item is not None:
+                                    writer.put_item(Item=table_item)
+                            progress['processed'] += 1
+                        except Exception as e:
+                            print(f"Erro ao processar {entry_name} do arquivo {key}: {str(e)}")
+                            progress['failed'] += 1
+                        completed_since_update += 1
+                    if completed_since_update >= ARCHIVE_PROGRESS_EVERY:
+                        update_progress('PROCESSING')
+                        completed_since_update = 0
+
+                for index, info in enumerate(entries):
+                    if receipt_ids[index] in stored_ids:
+                        continue
+                    if len(pending) >= max_pending:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(done)
+                    entry_name = os.path.basename(info.filename)
+                    entry_key = f"{ARCHIVE_EXTRACT_PREFIX}{archive_id}/{index:04d}-{entry_name}"
+                    content = archive.read(info)
+                    future = executor.submit(process_archive_entry, bucket, entry_key, content, user_id,
+                                             archive_id, receipt_ids[index])
+                    pending[future] = info.filename
+
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+        except Exception as e:
+            # Ex: entrada corrompida ou falha ao gravar um lote; uma nova tentativa retoma do ponto em que parou
+            print(f"Erro ao processar o arquivo {key}: {str(e)}")
+            update_progress('FAILED')
+            raise
+
+    update_progress('COMPLETED' if progress['failed'] == 0 else 'COMPLETED_WITH_ERRORS')
+    print(f"Arquivo {key} processado: {progress['processed']} recibos ({progress['skipped']} já processados), "
+          f"{progress['failed']} falhas")
+    return progress
@@ -0,0 +1,141 @@
+"""
+Reprocessa recibos já processados a partir das respostas do Textract arquivadas
+no S3 (textract-archive/<chave do recibo>.json.gz), sem chamar o Textract novamente.
+
+As respostas são interpretadas em processos paralelos com o mesmo código da Lambda
+(receiptprocessor.parse_expense_response) e apenas as despesas cujos campos mudaram
+são regravadas nas tabelas do KEY_SCHEMA configurado:
+
+    DYNAMODB_TABLE=Receipts python reprocess-receipts.py --dry-run
+    DYNAMODB_TABLE=Receipts python reprocess-receipts.py --workers 8
+
+Despesas editadas pelo usuário (com updated_timestamp) são ignoradas, a menos que
+--include-edited seja usado. As gravações são condicionais: uma despesa editada,
+reprocessada ou excluída enquanto o script roda não é sobrescrita (contada em 'skipped'). Com ITEM_INDEX_TABLE definido, o índice de preços por item
+das despesas alteradas também é atualizado.
+"""
+import argparse
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+import itemindex
+import receiptprocessor
+
+# Campos derivados da resposta do Textract
+REPARSED_FIELDS = ('date', 'vendor', 'total', 'items')
+
+def init_worker():
+    """Clientes boto3 não devem ser compartilhados entre processos: cada worker cria o seu"""
+    receiptprocessor.s3 = boto3.client('s3')
+
+def reparse(task):
+    """Interpreta novamente a resposta arquivada de um recibo; retorna (índice, campos, erro)"""
+    index, s3_path, current_date = task
+    bucket, _, key = s3_path[len('s3://'):].partition('/')
+    try:
+        response = receiptprocessor.load_textract_response(bucket, key)
+    except Exception as e:
+        return index, None, f"sem resposta arquivada ({str(e)})"
+    return index, receiptprocessor.parse_expense_response(response, current_date), None
+
+def scan_processed_receipts(table):
+    """Lista as despesas que vieram de recibos enviados ao S3"""
+    for item in receiptprocessor.scan_segment(table):
+        if item.get('s3_path', '').startswith('s3://') and not item['receipt_id'].startswith('archive-'):
+            item.pop('sort_key', None)
+            yield item
+
+def write_reprocessed(tables, old_item, new_item):
+    """
+    Grava a despesa reprocessada se a linha lida no scan não mudou desde então; retorna
+    False (sem gravar) se ela foi editada, reprocessada ou excluída nesse intervalo.
+    """
+    for position, (table, user_partitioned) in enumerate(tables):
+        table_item = receiptprocessor.item_for_table(new_item, user_partitioned)
+        if table_item is None:
+            continue
+        unchanged = receiptprocessor.unchanged_condition(old_item)
+        if position > 0:
+            # Na tabela nova do KEY_SCHEMA 'dual' a linha pode ainda não ter sido migrada
+            unchanged = Attr('receipt_id').not_exists() | unchanged
+        try:
+            if new_item['date'] == old_item['date']:
+                table.put_item(Item=table_item, ConditionExpression=unchanged)
+                continue
+            # 'date' faz parte da chave: a data corrigida gera um novo item, e o antigo só é
+            # apagado se não mudou (senão o novo é desfeito)
+            table.put_item(Item=table_item, ConditionExpression=Attr('receipt_id').not_exists())
+            try:
+                table.delete_item(Key=receiptprocessor.table_key(old_item, user_partitioned),
+                                  ConditionExpression=unchanged)
+            except ClientError:
+                table.delete_item(Key=receiptprocessor.table_key(new_item, user_partitioned))
+                raise
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            if position == 0:
+                return False
+            print(f"Aviso: {old_item['receipt_id']} foi alterado em {table.name} durante o reprocessamento.")
+    return True
+
+def show_progress(done, total, counters):
+    sys.stderr.write(
+        f"\rReprocessando {done}/{total} | alterados {counters['changed']} | "
+        f"sem alteração {counters['unchanged']} | sem arquivo {counters['missing']} | "
+        f"ignorados {counters['skipped']}"
+    )
+    sys.stderr.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description='Reprocessa recibos a partir das respostas arquivadas do Textract.')
+    parser.add_argument('--workers', type=int, default=None, help='Processos paralelos (padrão: número de CPUs)')
+    parser.add_argument('--include-edited', action='store_true', help='Também reprocessa despesas editadas pelo usuário')
+    parser.add_argument('--dry-run', action='store_true', help='Mostra as diferenças sem gravar')
+    args = parser.parse_args()
+
+    tables = receiptprocessor.receipt_tables()
+    index_table = None
+    if receiptprocessor.ITEM_INDEX_TABLE and not args.dry_run:
+        index_table = receiptprocessor.dynamodb_resource().Table(receiptprocessor.ITEM_INDEX_TABLE)
+    receipts = [
+        item for item in scan_processed_receipts(receiptprocessor.source_table())
+        if args.include_edited or 'updated_timestamp' not in item
+    ]
+    counters = {'changed': 0, 'unchanged': 0, 'missing': 0, 'skipped': 0}
+    tasks = [(index, item['s3_path'], item['date']) for index, item in enumerate(receipts)]
+
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as executor:
+        for done, (index, fields, error) in enumerate(executor.map(reparse, tasks, chunksize=16), start=1):
+            old_item = receipts[index]
+            if error:
+                counters['missing'] += 1
+            else:
+                changes = {field: fields[field] for field in REPARSED_FIELDS if old_item.get(field) != fields[field]}
+                if not changes:
+                    counters['unchanged'] += 1
+                elif args.dry_run:
+                    counters['changed'] += 1
+                    sys.stderr.write('\n')
+                    for field, value in changes.items():
+                        print(f"{old_item['receipt_id']} {field}: {old_item.get(field)!r} -> {value!r}")
+                else:
+                    new_item = dict(old_item, **changes, reprocessed_timestamp=datetime.now().isoformat())
+                    if not write_reprocessed(tables, old_item, new_item):
+                        counters['skipped'] += 1
+                    else:
+                        counters['changed'] += 1
+                        if index_table is not None:
+                            itemindex.update_item_index(index_table, old_item, new_item)
+            show_progress(done, len(tasks), counters)
+
+    sys.stderr.write('\n')
+    print(f"Reprocessamento concluído{' (dry-run)' if args.dry_run else ''}: {counters}")
+
+if __name__ == '__main__':
+    main()
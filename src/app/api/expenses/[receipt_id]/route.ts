@@ -4,6 +4,42 @@ import { ManualExpenseInput } from '@/lib/types';
 
 const API_GATEWAY_URL = process.env.NEXT_PUBLIC_API_GATEWAY_URL;
 
+// Consulta o progresso de um arquivo ZIP de recibos (receipt_id no formato "archive-<id>")
+export async function GET(
+  req: Request,
+  { params }: { params: Promise<{ receipt_id: string }> }
+) {
+  const { receipt_id: receiptId } = await params;
+
+  if (!API_GATEWAY_URL) {
+    return NextResponse.json({ error: 'API Gateway URL not configured' }, { status: 500 });
+  }
+
+  try {
+    const token = req.headers.get('Authorization');
+    if (!token) {
+      return NextResponse.json({ error: 'Authorization token is missing' }, { status: 401 });
+    }
+
+    const response = await fetch(`${API_GATEWAY_URL}/expenses/${encodeURIComponent(receiptId)}`, {
+      method: 'GET',
+      headers: {
+        'Content-Type': 'application/json',
+        'Authorization': token,
+      },
+    });
+
+    const result = await response.json().catch(() => ({}));
+    if (!response.ok) {
+      return NextResponse.json({ error: result.message || response.statusText }, { status: response.status });
+    }
+    return NextResponse.json(result);
+  } catch (error: any) {
+    console.error('Error fetching archive progress:', error);
+    return NextResponse.json({ error: error.message || 'Failed to fetch archive progress' }, { status: 500 });
+  }
+}
+
 export async function PUT(
   req: Request,
   { params }: { params: Promise<{ receipt_id: string }> }
@@ -15,7 +15,9 @@ export async function GET(req: Request) {
         return NextResponse.json({ error: 'Authorization token is missing' }, { status: 401 });
     }
 
-    const response = await fetch(`${API_GATEWAY_URL}/expenses`, {
+    // Repassa o período opcional (startDate/endDate), que inclui despesas arquivadas no S3
+    const { search } = new URL(req.url);
+    const response = await fetch(`${API_GATEWAY_URL}/expenses${search}`, {
       method: 'GET',
       headers: {
         'Content-Type': 'application/json',
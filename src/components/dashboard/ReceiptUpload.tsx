@@ -121,11 +121,11 @@ export function ReceiptUpload({ onUploadSuccess }: ReceiptUploadProps) {
     <div className="space-y-4">
       <h3 className="text-lg font-medium">Anexar Recibo</h3>
       <div className="grid w-full max-w-sm items-center gap-1.5">
-        <Label htmlFor="receipt">Recibo (imagem ou PDF)</Label>
+        <Label htmlFor="receipt">Recibo (imagem, PDF ou ZIP com vários recibos)</Label>
         <Input 
           id="receipt" 
           type="file" 
-          accept="image/*,application/pdf" 
+          accept="image/*,application/pdf,application/zip,.zip" 
           onChange={handleFileChange}
           disabled={loading || !isAuthenticated}
         />